@@ -0,0 +1,1675 @@
+import bisect
+import gzip
+import hashlib
+import heapq
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import random
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import CancelledError, ThreadPoolExecutor, as_completed
+from urllib.parse import urlencode
+
+import requests
+import urllib3
+
+# the Ocean Navigator server; see apiCalls.setBaseUrl and onavMock
+defaultUrl = 'http://navigator.oceansdata.ca'
+
+# every apiCalls.log message also goes here, for setLogFile
+logger = logging.getLogger('onavlite')
+logger.addHandler(logging.NullHandler())
+
+# datasets offered by the app, keyed by display name
+datasets = { '01. GIOPS 10 day Forecast 3D - LatLon' : 'giops_day',
+            '05. CCG RIOPS Forecast Surface - LatLon' : 'riops_fc_2dll',
+            '06. RIOPS Forecast 3D - Polar Stereographic' : 'riops_fc_3dps'
+        }
+
+quantums = {'giops_day' : 'day',
+            'riops_fc_2dll' : 'hour',
+            'riops_fc_3dps' : 'hour',
+            }
+
+variables = {'giops_day' : {"Temperature" : "votemper",
+                            "Salinity" : "vosaline",
+                            "Speed of Sound" : "sspeed",
+                            "Sound Channel Axis" : "deepsoundchannel",
+                            "Critical Depth" : "deepsoundchannelbottom",
+                            "Depth Excess": "depthexcess",
+                            "Potential Sub Surface Channel" : "psubsurfacechannel",
+                            "Water Velocity" : "magwatervel",
+                            },
+            'riops_fc_2dll' : {"Temperature" : "votemper",
+                                "Salinity" : "vosaline",
+                                "Sea Surface Height" : "sossheig",
+                                "Water Velocity" : "magwatervel",
+                                },
+            'riops_fc_3dps' : {"Temperature" : "votemper",
+                                "Salinity" : "vosaline",
+                                "Speed of Sound" : "sspeed",
+                                "Sound Channel Axis" : "deepsoundchannel",
+                                "Critical Depth" : "deepsoundchannelbottom",
+                                "Depth Excess": "depthexcess",
+                                "Potential Sub Surface Channel" : "psubsurfacechannel",
+                                "Water Velocity" : "magwatervel",
+                                },
+            }
+
+
+def profileJob(dataset, variable, quantum, time, point):
+    # variable may be a list to get several variables in one request
+    variable = [variable] if isinstance(variable, str) else list(variable)
+    fileName = '_'.join(['Profile', dataset, '-'.join(variable), str(time), str(point)])
+
+    query = {"dataset":dataset,
+            "names":[],
+            "plotTitle":"",
+            "quantum":quantum,
+            "showmap":0,
+            "station":[point],
+            "time":time,
+            "type":"profile",
+            "variable":variable}
+
+    return query, fileName
+
+def mooringJob(dataset, variable, quantum, starttime, endtime, point):
+    fileName = '_'.join(['Virtual_Mooring', dataset, variable, str(starttime), str(endtime), str(point)])
+
+    query = {"colormap":"default",
+            "dataset":dataset,
+            "depth":0,
+            "endtime":endtime,
+            "names":[],
+            "plotTitle":"",
+            "quantum":quantum,
+            "scale":"-5,30,auto",
+            "showmap":0,
+            "starttime":starttime,
+            "station":[point],
+            "type":"timeseries",
+            "variable":variable
+        }
+
+    return query, fileName
+
+def areaJob(dataset, variable, quantum, time, points, arrowVar='none', contourVar='none'):
+    fileName = '_'.join(['Area', dataset, variable, str(time)])
+
+    query = {"area":[{"innerrings":[],
+            "name":"",
+            "polygons":[points]}],
+            "bathymetry":1,
+            "colormap":"default",
+            "contour":{"colormap":"default",
+            "hatch":0,
+            "legend":1,
+            "levels":"auto",
+            "variable":contourVar},
+            "dataset":dataset,
+            "depth":0,
+            "interp":"gaussian",
+            "neighbours":10,
+            "projection":"EPSG:3857",
+            "quantum":quantum,
+            "quiver":{"colormap":"default",
+            "magnitude":"length",
+            "variable":arrowVar},
+            "radius":25,
+            "scale":"-5,30,auto",
+            "showarea":1,
+            "time":time,
+            "type":"map",
+            "variable":variable
+        }
+
+    return query, fileName
+
+
+def setLogFile(path, level=logging.DEBUG, maxBytes=1024 ** 2, backupCount=3):
+    # mirror log messages at or above level to path, starting a new file
+    # once it reaches maxBytes and keeping backupCount old ones; None stops
+    for handler in list(logger.handlers):
+        if isinstance(handler, logging.handlers.RotatingFileHandler):
+            logger.removeHandler(handler)
+            handler.close()
+    if path is None:
+        logger.setLevel(logging.NOTSET)
+        return
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    handler = logging.handlers.RotatingFileHandler(path, maxBytes=maxBytes, backupCount=backupCount,
+                                                   encoding='utf-8')
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)-7s %(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(level)
+
+def clipPolygon(points, south, north, west, east):
+    # Sutherland-Hodgman clip of a [lat, lon] polygon to a lat/lon box
+    edges = [lambda p: p[0] >= south,
+             lambda p: p[0] <= north,
+             lambda p: p[1] >= west,
+             lambda p: p[1] <= east]
+    bounds = [(0, south), (0, north), (1, west), (1, east)]
+
+    for inside, (axis, value) in zip(edges, bounds):
+        clipped = []
+        for i, current in enumerate(points):
+            previous = points[i - 1]
+            if inside(current) != inside(previous):
+                # add the point where this edge crosses the boundary
+                t = (value - previous[axis]) / (current[axis] - previous[axis])
+                crossing = [previous[0] + t * (current[0] - previous[0]),
+                            previous[1] + t * (current[1] - previous[1])]
+                crossing[axis] = value
+                clipped.append(crossing)
+            if inside(current):
+                clipped.append(list(current))
+        points = clipped
+        if not points:
+            break
+
+    return points
+
+
+class MetadataCache():
+    # small on-disk cache of timestamp and depth lists keyed by
+    # (server, endpoint, dataset, variable), stored as gzipped JSON. Entries older than
+    # their endpoint's TTL are still returned but flagged stale so the caller
+    # can show them straight away and refresh in the background.
+
+    ttl = {'timestamps' : 60 * 60,
+           'depth' : 30 * 24 * 60 * 60}
+
+    def __init__(self, path=None, maxEntries=256):
+        if path is None:
+            path = os.path.join(os.path.expanduser('~'), '.onavlite', 'metadata_cache.json.gz')
+        self.path = path
+        self.maxEntries = maxEntries
+        self.entries = None
+        self.lock = threading.Lock()
+
+    def key(self, server, endpoint, dataset, variable):
+        return '|'.join([server, endpoint, dataset, variable])
+
+    def load(self):
+        # read the cache file the first time it is needed
+        if self.entries is not None:
+            return
+        try:
+            with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmpName = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with gzip.open(os.fdopen(fd, 'wb'), 'wt', encoding='utf-8') as f:
+                json.dump(self.entries, f, separators=(',', ':'))
+            os.replace(tmpName, self.path)
+        except OSError:
+            if os.path.exists(tmpName):
+                os.remove(tmpName)
+
+    def lookup(self, server, endpoint, dataset, variable):
+        # returns (data, fresh), or (None, False) if nothing is cached
+        with self.lock:
+            self.load()
+            entry = self.entries.get(self.key(server, endpoint, dataset, variable))
+            if entry is None:
+                return None, False
+            entry['used'] = time.time()
+            fresh = time.time() - entry['fetched'] < self.ttl.get(endpoint, 0)
+            return entry['data'], fresh
+
+    def store(self, server, endpoint, dataset, variable, data):
+        with self.lock:
+            self.load()
+            now = time.time()
+            self.entries[self.key(server, endpoint, dataset, variable)] = {'fetched' : now, 'used' : now, 'data' : data}
+
+            # evict the least recently used entries beyond the size limit
+            if len(self.entries) > self.maxEntries:
+                byAge = sorted(self.entries, key=lambda k: self.entries[k]['used'])
+                for k in byAge[:len(self.entries) - self.maxEntries]:
+                    del self.entries[k]
+
+            self.save()
+
+class ResultCache():
+    # downloaded CSV/PNG results stored under a hash of the server, the
+    # canonical query JSON, output format and dpi, so resubmitting an identical query is
+    # served from disk. A file's modification time is when it was added:
+    # forecasts for a given time id are republished every cycle, so entries
+    # older than their quantum's TTL are fetched again. Access times,
+    # set on every hit, give the LRU order.
+
+    ttl = {'day' : 12 * 60 * 60,
+           'hour' : 6 * 60 * 60}
+
+    def __init__(self, path=None, maxBytes=1024 ** 3, useHardlinks=False):
+        if path is None:
+            path = os.path.join(os.path.expanduser('~'), '.onavlite', 'results')
+        self.path = path
+        self.maxBytes = maxBytes
+        self.useHardlinks = useHardlinks
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def key(self, server, query, outputFormat, dpi):
+        canonical = json.dumps(query, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256('|'.join([server, canonical, outputFormat, str(dpi)]).encode('utf-8')).hexdigest()
+
+    def entryPath(self, key, outputFormat):
+        return os.path.join(self.path, key + '.' + outputFormat)
+
+    def fetch(self, key, outputFormat, fileName, quantum=None):
+        # copy a cached result to fileName; returns False on a miss or when
+        # the entry has outlived quantum's TTL
+        entry = self.entryPath(key, outputFormat)
+        try:
+            st = os.stat(entry)
+            if time.time() - st.st_mtime >= self.ttl.get(quantum, 6 * 60 * 60):
+                raise FileNotFoundError(entry)
+            if os.path.exists(fileName):
+                os.remove(fileName)
+            if self.useHardlinks:
+                try:
+                    os.link(entry, fileName)
+                except OSError:
+                    shutil.copyfile(entry, fileName)
+            else:
+                shutil.copyfile(entry, fileName)
+            os.utime(entry, (time.time(), st.st_mtime))
+        except OSError:
+            with self.lock:
+                self.misses += 1
+            return False
+
+        with self.lock:
+            self.hits += 1
+        return True
+
+    def add(self, key, outputFormat, fileName):
+        # store a completed download and trim the cache back under maxBytes
+        os.makedirs(self.path, exist_ok=True)
+        fd, tmpName = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        os.close(fd)
+        try:
+            if self.useHardlinks:
+                # os.link won't replace the placeholder mkstemp made
+                os.remove(tmpName)
+                try:
+                    os.link(fileName, tmpName)
+                except OSError:
+                    shutil.copyfile(fileName, tmpName)
+            else:
+                shutil.copyfile(fileName, tmpName)
+            os.replace(tmpName, self.entryPath(key, outputFormat))
+        except OSError:
+            if os.path.exists(tmpName):
+                os.remove(tmpName)
+            return
+        self.evict()
+
+    def evict(self):
+        with self.lock:
+            entries = []
+            for name in os.listdir(self.path):
+                if name.endswith('.tmp'):
+                    continue
+                st = os.stat(os.path.join(self.path, name))
+                entries.append((st.st_atime, st.st_size, name))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total <= self.maxBytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except OSError:
+                    continue
+                total -= size
+
+class SyncManifest():
+    # what an incremental sync has already downloaded: one entry per
+    # (dataset, variable, station, time) naming the file it went into, and
+    # the time step each synced request started from. Kept as JSON beside
+    # the results; delete an entry, or the whole manifest, to fetch it again.
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.starts = {}
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            self.entries = data.get('entries', {})
+            self.starts = data.get('starts', {})
+        except (OSError, ValueError):
+            pass
+
+    def key(dataset, variable, station, time):
+        # station is a [lat, lon] point or, for areas, the polygon
+        if not isinstance(variable, str):
+            variable = '-'.join(variable)
+        return '|'.join([dataset, variable, json.dumps(station, separators=(',', ':')), str(time)])
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def start(self, kind, dataset, variable, time):
+        # the time step a request was first synced from
+        key = SyncManifest.key(dataset, variable, kind, 'start')
+        return self.starts.setdefault(key, time)
+
+    def add(self, keys, fileName):
+        now = time.time()
+        for key in keys:
+            self.entries[key] = {'file' : fileName, 'fetched' : now}
+
+    def save(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmpName = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'entries' : self.entries, 'starts' : self.starts}, f, indent=1)
+            os.replace(tmpName, self.path)
+        except OSError:
+            if os.path.exists(tmpName):
+                os.remove(tmpName)
+            raise
+
+class ColumnarStore():
+    # collects many downloaded result CSVs into one NumPy record array saved
+    # as <path>.npy (readable with numpy.load(path, mmap_mode='r')) plus a
+    # <path>.json sidecar naming the stations and variables. Rows are long
+    # format: station, lat, lon, time, depth, variable, value. Each CSV is
+    # converted column-wise and appended to a raw record file, so only one
+    # response is held in memory at a time. A CSV without a time column
+    # (a profile) can be given the time its query asked for.
+
+    dtype = [('station', '<i4'), ('lat', '<f8'), ('lon', '<f8'), ('time', '<M8[s]'),
+             ('depth', '<f8'), ('variable', '<i2'), ('value', '<f8')]
+
+    def __init__(self, path):
+        import numpy as np
+
+        self.path = path[:-4] if path.endswith('.npy') else path
+        self.stations = []
+        self.variables = []
+        self.rows = 0
+        self.recordType = np.dtype(self.dtype)
+        self.raw = open(self.path + '.records', 'wb')
+
+    def floats(self, column):
+        import numpy as np
+
+        try:
+            return column.astype(float)
+        except ValueError:
+            # units or blanks in some cells; anything unparseable is NaN
+            out = np.full(column.shape, np.nan)
+            for i, v in enumerate(column):
+                try:
+                    out[i] = float(v)
+                except ValueError:
+                    pass
+            return out
+
+    def times(self, column):
+        import numpy as np
+
+        try:
+            return np.char.replace(column.astype('U19'), ' ', 'T').astype('M8[s]')
+        except ValueError:
+            return np.full(column.shape, np.datetime64('NaT'), dtype='M8[s]')
+
+    def append(self, station, fileName, time=None):
+        # time, as the server writes it ('2026-01-01 00:00:00'), is used
+        # when the CSV has no time column
+        import numpy as np
+
+        with open(fileName, newline='') as f:
+            lines = [line for line in f if line.strip() and not line.startswith('//')]
+        if len(lines) < 2:
+            return
+
+        columns = [c.strip() for c in lines[0].split(',')]
+        data = np.loadtxt(lines[1:], delimiter=',', dtype=str, ndmin=2)
+        data = np.char.strip(data)
+        rowCount = data.shape[0]
+
+        def find(*prefixes):
+            for k, c in enumerate(columns):
+                if c.lower().startswith(prefixes):
+                    return k
+            return None
+
+        lat, lon, timeColumn, depth = find('lat'), find('lon'), find('time', 'date'), find('depth')
+        special = {lat, lon, timeColumn, depth}
+        if timeColumn is not None:
+            times = self.times(data[:, timeColumn])
+        elif time is not None:
+            times = self.times(np.array([time]))[0]
+        else:
+            times = np.datetime64('NaT')
+        valueColumns = [k for k in range(len(columns)) if k not in special]
+
+        stationId = len(self.stations)
+        self.stations.append(station)
+
+        # one block of records per value column (long format)
+        for k in valueColumns:
+            if columns[k] not in self.variables:
+                self.variables.append(columns[k])
+
+            block = np.zeros(rowCount, dtype=self.recordType)
+            block['station'] = stationId
+            block['lat'] = self.floats(data[:, lat]) if lat is not None else np.nan
+            block['lon'] = self.floats(data[:, lon]) if lon is not None else np.nan
+            block['time'] = times
+            block['depth'] = self.floats(data[:, depth]) if depth is not None else np.nan
+            block['variable'] = self.variables.index(columns[k])
+            block['value'] = self.floats(data[:, k])
+
+            self.raw.write(block.tobytes())
+            self.rows += rowCount
+
+    def close(self):
+        # write the .npy header, then stream the raw records in after it
+        import numpy as np
+
+        self.raw.close()
+        with open(self.path + '.npy', 'wb') as out:
+            np.lib.format.write_array_header_1_0(out, {'descr' : np.lib.format.dtype_to_descr(self.recordType),
+                                                       'fortran_order' : False,
+                                                       'shape' : (self.rows,)})
+            with open(self.path + '.records', 'rb') as raw:
+                shutil.copyfileobj(raw, out, 1024 * 1024)
+        os.remove(self.path + '.records')
+
+        with open(self.path + '.json', 'w') as f:
+            json.dump({'stations' : self.stations, 'variables' : self.variables}, f, indent=1)
+
+class GridIndex():
+    # nearest-model-cell lookup for one dataset. The model grid's lat/lon
+    # coordinates are read from <gridDir>/<dataset>.npz (arrays 'lat' and
+    # 'lon', 1-D axes or 2-D fields); points are bucketed into square
+    # lat/lon bins and the sorted bucket index is cached next to it as
+    # <dataset>.index.npz so it is only built once.
+
+    def __init__(self, dataset, gridDir=None):
+        if gridDir is None:
+            gridDir = os.path.join(os.path.expanduser('~'), '.onavlite', 'grids')
+        self.gridFile = os.path.join(gridDir, dataset + '.npz')
+        self.indexFile = os.path.join(gridDir, dataset + '.index.npz')
+        self.loaded = False
+
+    def available(self):
+        return os.path.exists(self.gridFile)
+
+    def load(self):
+        import numpy as np
+
+        if self.loaded:
+            return
+        if (os.path.exists(self.indexFile) and
+                os.path.getmtime(self.indexFile) >= os.path.getmtime(self.gridFile)):
+            with np.load(self.indexFile) as index:
+                self.lat, self.lon = index['lat'], index['lon']
+                self.bins, self.binSize = index['bins'], float(index['binSize'])
+        else:
+            self.build()
+        self.columns = int(np.ceil(360 / self.binSize))
+        self.loaded = True
+
+    def build(self):
+        import numpy as np
+
+        with np.load(self.gridFile) as grid:
+            lat, lon = grid['lat'], grid['lon']
+        if lat.ndim == 1 and lon.ndim == 1:
+            lon, lat = np.meshgrid(lon, lat)
+        lat = lat.ravel().astype(float)
+        lon = (lon.ravel().astype(float) + 180) % 360 - 180
+
+        # bins a little wider than the mean cell spacing
+        latSpan = max(lat.max() - lat.min(), 1e-6)
+        lonSpan = max(lon.max() - lon.min(), 1e-6)
+        self.binSize = max(2 * np.sqrt(latSpan * lonSpan / len(lat)), 0.01)
+
+        bins = self.binOf(lat, lon)
+        order = np.argsort(bins, kind='stable')
+        self.lat, self.lon, self.bins = lat[order], lon[order], bins[order]
+
+        tmpName = self.indexFile + '.tmp.npz'
+        np.savez(tmpName, lat=self.lat, lon=self.lon, bins=self.bins, binSize=self.binSize)
+        os.replace(tmpName, self.indexFile)
+
+    def binOf(self, lat, lon):
+        import numpy as np
+
+        rows = np.floor((np.asarray(lat) + 90) / self.binSize).astype(np.int64)
+        cols = np.floor((np.asarray(lon) + 180) / self.binSize).astype(np.int64)
+        return rows * int(np.ceil(360 / self.binSize)) + cols
+
+    def nearest(self, lat, lon):
+        # flat index (into the sorted grid) of the closest grid point within
+        # two bins of (lat, lon), or None if the point is off the grid
+        import numpy as np
+
+        self.load()
+        lon = (lon + 180) % 360 - 180
+        row = int(np.floor((lat + 90) / self.binSize))
+        col = int(np.floor((lon + 180) / self.binSize))
+
+        candidates = []
+        for dr in range(-2, 3):
+            for dc in range(-2, 3):
+                b = (row + dr) * self.columns + (col + dc) % self.columns
+                start, end = np.searchsorted(self.bins, [b, b + 1])
+                if end > start:
+                    candidates.append(np.arange(start, end))
+        if not candidates:
+            return None
+
+        candidates = np.concatenate(candidates)
+        dLat = np.radians(self.lat[candidates] - lat)
+        dLon = np.radians(self.lon[candidates] - lon)
+        a = np.sin(dLat / 2) ** 2 + np.cos(np.radians(lat)) * np.cos(np.radians(self.lat[candidates])) * np.sin(dLon / 2) ** 2
+        return int(candidates[np.argmin(a)])
+
+class LogBuffer():
+    # thread-safe ring buffer of the newest maxLines log records, as
+    # (time, level, message). count goes up by one per message ever
+    # appended, so a reader can fetch just what arrived since it last looked.
+
+    def __init__(self, maxLines=5000):
+        self.lines = deque(maxlen=maxLines)
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def append(self, message, level=logging.INFO):
+        with self.lock:
+            self.lines.append((time.time(), level, message))
+            self.count += 1
+
+    def since(self, count, level=logging.NOTSET):
+        # records at or above level appended after the count-th message, up
+        # to the size of the buffer; returns (records, current count)
+        with self.lock:
+            new = min(self.count - count, len(self.lines))
+            records = list(itertools.islice(reversed(self.lines), max(0, new)))
+            return [r for r in reversed(records) if r[1] >= level], self.count
+
+    def tail(self, level=logging.NOTSET, limit=None):
+        records, _ = self.since(0, level)
+        return records if limit is None else records[-limit:]
+
+class Telemetry():
+    # one record per network request: time spent waiting for a scheduler
+    # slot, resolving, connecting, in the TLS handshake, waiting for the
+    # first byte and transferring the body, plus backoff sleeps and
+    # validation, with the bytes received, final HTTP status and number of
+    # retries. Records are kept in memory
+    # (the newest maxRecords) and, if path is set, appended to it as JSON
+    # lines. The timed connection classes below add their phase times to
+    # the record of the request running on the same thread.
+
+    local = threading.local()
+    phases = ('queued', 'dns', 'connect', 'tls', 'ttfb', 'transfer', 'backoff', 'validate')
+    buckets = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, path=None, maxRecords=10000):
+        self.path = path
+        self.records = deque(maxlen=maxRecords)
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def addPhase(name, seconds):
+        record = getattr(Telemetry.local, 'record', None)
+        if record is not None:
+            record[name] += seconds
+
+    def connectionTime(record):
+        return record['dns'] + record['connect'] + record['tls']
+
+    def start(self, kind, url):
+        record = {'kind' : kind, 'url' : url, 'started' : time.time(), 'ok' : False,
+                  'status' : None, 'retries' : 0, 'bytes' : 0}
+        record.update((name, 0.0) for name in Telemetry.phases)
+        Telemetry.local.record = record
+        Telemetry.local.start = time.perf_counter()
+        return record
+
+    def finish(self, record):
+        record['total'] = time.perf_counter() - Telemetry.local.start
+        Telemetry.local.record = None
+        for name in Telemetry.phases + ('total',):
+            record[name] = round(record[name], 4)
+
+        with self.lock:
+            self.count += 1
+            record['seq'] = self.count
+            self.records.append(record)
+            if self.path:
+                try:
+                    with open(self.path, 'a') as f:
+                        f.write(json.dumps(record) + '\n')
+                except OSError:
+                    # metrics are never worth failing a download over
+                    pass
+
+    def since(self, seq, kind=None):
+        # records finished after record number seq
+        with self.lock:
+            return [r for r in self.records if r['seq'] > seq and kind in (None, r['kind'])]
+
+    def export(self, path, records=None):
+        records = list(self.records) if records is None else records
+        with open(path, 'a') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+
+    def summarize(records):
+        # latency percentiles and histogram, mean phase times and throughput
+        # over the wall-clock span of records
+        if not records:
+            return {'requests' : 0}
+
+        totals = sorted(r['total'] for r in records)
+        def percentile(p):
+            return totals[min(len(totals) - 1, int(p / 100 * len(totals)))]
+
+        histogram = [0] * (len(Telemetry.buckets) + 1)
+        for t in totals:
+            histogram[bisect.bisect_left(Telemetry.buckets, t)] += 1
+
+        wall = max(r['started'] + r['total'] for r in records) - min(r['started'] for r in records)
+        received = sum(r['bytes'] for r in records)
+        return {'requests' : len(records),
+                'ok' : sum(r['ok'] for r in records),
+                'retries' : sum(r['retries'] for r in records),
+                'bytes' : received,
+                'wall' : round(wall, 3),
+                'throughput' : round(received / wall, 1) if wall > 0 else 0.0,
+                'requestRate' : round(len(records) / wall, 3) if wall > 0 else 0.0,
+                'latency' : {'min' : totals[0], 'p50' : percentile(50), 'p90' : percentile(90),
+                             'p99' : percentile(99), 'max' : totals[-1]},
+                'phases' : {name : round(sum(r[name] for r in records) / len(records), 4)
+                            for name in Telemetry.phases},
+                'histogram' : list(zip([f'<{b} s' for b in Telemetry.buckets] + [f'>={Telemetry.buckets[-1]} s'],
+                                       histogram))}
+
+    def report(stats):
+        # console lines for a summarize() result
+        latency = stats['latency']
+        lines = [f"{stats['requests']} requests ({stats['ok']} ok, {stats['retries']} retries), "
+                 f"{stats['bytes'] / 1e6:.2f} MB in {stats['wall']:.1f} s: "
+                 f"{stats['throughput'] / 1e6:.2f} MB/s, {stats['requestRate']:.2f} requests/s",
+                 f"Latency p50 {latency['p50']:.2f} s, p90 {latency['p90']:.2f} s, "
+                 f"p99 {latency['p99']:.2f} s, max {latency['max']:.2f} s",
+                 'Mean time per request: ' + ', '.join(f'{name} {t:.3f} s' for name, t in stats['phases'].items() if t)]
+        peak = max(count for _, count in stats['histogram'])
+        for label, count in stats['histogram']:
+            if count:
+                lines.append(f"  {label:>8} {count:6d} {'#' * max(1, round(30 * count / peak))}")
+        return lines
+
+class TimedConnection():
+    # mixed into urllib3's connection classes so new connections report
+    # their DNS lookup, TCP connect and TLS handshake times to Telemetry
+
+    def _new_conn(self):
+        start = time.perf_counter()
+        host = self._dns_host
+        try:
+            addresses = socket.getaddrinfo(host, self.port, 0, socket.SOCK_STREAM)
+        except socket.gaierror:
+            # let urllib3 raise its usual error
+            return super()._new_conn()
+        resolved = time.perf_counter()
+
+        # connect to the resolved addresses in turn so the name is only
+        # looked up once
+        try:
+            for i, address in enumerate(addresses):
+                self._dns_host = address[4][0]
+                try:
+                    sock = super()._new_conn()
+                    break
+                except urllib3.exceptions.ConnectTimeoutError:
+                    if i == len(addresses) - 1:
+                        raise
+        finally:
+            self._dns_host = host
+
+        self.socketTime = time.perf_counter() - start
+        Telemetry.addPhase('dns', resolved - start)
+        Telemetry.addPhase('connect', time.perf_counter() - resolved)
+        return sock
+
+    def connect(self):
+        self.socketTime = 0.0
+        start = time.perf_counter()
+        super().connect()
+        Telemetry.addPhase('tls', max(0.0, time.perf_counter() - start - self.socketTime))
+
+class TimedHTTPConnection(TimedConnection, urllib3.connection.HTTPConnection):
+    pass
+
+class TimedHTTPSConnection(TimedConnection, urllib3.connection.HTTPSConnection):
+    pass
+
+class TimedHTTPConnectionPool(urllib3.connectionpool.HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+class TimedHTTPSConnectionPool(urllib3.connectionpool.HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+def timedSession(poolSize):
+    # a requests session sharing one keep-alive pool of poolSize timed
+    # connections between threads
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=poolSize)
+    adapter.poolmanager.pool_classes_by_scheme = {'http' : TimedHTTPConnectionPool,
+                                                  'https' : TimedHTTPSConnectionPool}
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+class RequestScheduler():
+    # admission control shared by every request to the server. Requests
+    # wait in a priority queue (interactive before bulk before background,
+    # first come first served within a level) for one of `limit` in-flight
+    # slots, and starts are spaced to stay under maxRate per second when it
+    # is set. With adaptive set, limit follows AIMD between minConcurrency
+    # and maxConcurrency: it grows by one per round of successful requests
+    # and halves, at most once per round trip, on a 5xx, 429, timeout or
+    # connection error, or when the smoothed time to first byte of a kind
+    # of request rises past latencyTolerance times the fastest seen for
+    # that kind. A metadata lookup answers in a fraction of a plot's time,
+    # so each kind is only compared with itself.
+
+    INTERACTIVE, BULK, BACKGROUND = 0, 1, 2
+
+    local = threading.local()
+
+    def __init__(self, maxConcurrency=4, minConcurrency=1, maxRate=0, adaptive=True,
+                 latencyTolerance=2.0, latencySlack=0.1):
+        self.maxConcurrency = maxConcurrency
+        self.minConcurrency = minConcurrency
+        self.maxRate = maxRate
+        self.adaptive = adaptive
+        self.latencyTolerance = latencyTolerance
+        self.latencySlack = latencySlack
+        self.limit = float(min(4, maxConcurrency))
+        self.inFlight = 0
+        self.waiting = []
+        self.tickets = itertools.count()
+        self.nextStart = 0.0
+        self.fastest = {}
+        self.smoothed = {}
+        self.lastDecrease = 0.0
+        self.condition = threading.Condition()
+
+    def setMaxConcurrency(self, maxConcurrency):
+        with self.condition:
+            self.maxConcurrency = max(self.minConcurrency, int(maxConcurrency))
+            self.limit = min(self.limit, self.maxConcurrency)
+            self.condition.notify_all()
+
+    def runAt(self, priority, fn, *args, **kwargs):
+        # run fn on this thread with its requests queued at priority
+        previous = getattr(RequestScheduler.local, 'priority', None)
+        RequestScheduler.local.priority = priority
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            RequestScheduler.local.priority = previous
+
+    def acquire(self):
+        priority = getattr(RequestScheduler.local, 'priority', None)
+        entry = (RequestScheduler.INTERACTIVE if priority is None else priority, next(self.tickets))
+        start = time.perf_counter()
+
+        with self.condition:
+            heapq.heappush(self.waiting, entry)
+            while True:
+                limit = int(self.limit) if self.adaptive else self.maxConcurrency
+                if self.waiting[0] == entry and self.inFlight < limit:
+                    delay = self.nextStart - time.monotonic() if self.maxRate else 0
+                    if delay <= 0:
+                        break
+                    self.condition.wait(delay)
+                else:
+                    self.condition.wait()
+
+            heapq.heappop(self.waiting)
+            self.inFlight += 1
+            if self.maxRate:
+                self.nextStart = max(self.nextStart, time.monotonic()) + 1 / self.maxRate
+            # let the next in line check for a free slot
+            self.condition.notify_all()
+
+        Telemetry.addPhase('queued', time.perf_counter() - start)
+
+    def release(self, latency=None, overloaded=False, kind=None):
+        with self.condition:
+            self.inFlight -= 1
+            if self.adaptive:
+                if overloaded or self.slow(latency, kind):
+                    # failures from one round of requests count once
+                    now = time.monotonic()
+                    if now - self.lastDecrease > self.smoothed.get(kind, 1.0):
+                        self.limit = max(self.minConcurrency, self.limit / 2)
+                        self.lastDecrease = now
+                elif latency is not None:
+                    self.limit = min(self.maxConcurrency, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+    def slow(self, latency, kind):
+        if latency is None:
+            return False
+        smoothed = self.smoothed.get(kind)
+        smoothed = self.smoothed[kind] = latency if smoothed is None else 0.8 * smoothed + 0.2 * latency
+        # let the fastest time creep up so one lucky request doesn't
+        # hold the limit down for good
+        fastest = self.fastest.get(kind)
+        fastest = self.fastest[kind] = latency if fastest is None else min(latency, fastest * 1.001)
+        return smoothed > max(self.latencyTolerance * fastest, fastest + self.latencySlack)
+
+    @contextmanager
+    def slot(self, kind=None):
+        # hold an in-flight slot for the body of the with block; set
+        # 'latency' (time to first byte) and 'overloaded' in the yielded
+        # dict to feed the concurrency control. Latencies are compared
+        # with earlier ones of the same kind only.
+        outcome = {'latency' : None, 'overloaded' : False}
+        self.acquire()
+        try:
+            yield outcome
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError):
+            outcome['overloaded'] = True
+            raise
+        finally:
+            self.release(outcome['latency'], outcome['overloaded'], kind)
+
+class apiCalls():
+
+    baseUrl = defaultUrl
+    metadataCache = MetadataCache()
+    printLevel = logging.INFO
+    # full PIL decode of every PNG download, on top of the header check
+    verifyPng = False
+    metadataSession = timedSession(4)
+    telemetry = Telemetry()
+    scheduler = RequestScheduler()
+    printLock = threading.Lock()
+
+    def __init__(self, console=None, maxWorkers=4, resultCache=None):
+        self.console = console
+        self.dpi = 144
+        self.location = os.getcwd()
+        self.base_plot_url = apiCalls.baseUrl + '/api/v1.0/plot/?'
+        self.maxWorkers = maxWorkers
+        self.session = self.makeSession(maxWorkers)
+        apiCalls.scheduler.setMaxConcurrency(maxWorkers)
+        self.resultCache = resultCache if resultCache is not None else ResultCache()
+
+        # download retry policy: (connect, read) timeouts in seconds and
+        # exponential backoff between attempts
+        self.timeout = (10, 60)
+        self.retries = 4
+        self.backoff = 1.0
+        self.maxBackoff = 30
+        self.retryStatus = (429, 500, 502, 503, 504)
+        self.timeChunkSize = 0
+        self.tileGrid = (1, 1)
+        self.tileOverlap = 0.1
+        self.snapToGrid = False
+        self.splitVariables = False
+        self.gridIndexes = {}
+
+    def makeSession(self, poolSize):
+        # share one keep-alive connection pool between all worker threads
+        return timedSession(poolSize)
+
+    def setMaxWorkers(self, maxWorkers):
+        # resize the worker pool and its connection pool together; the
+        # scheduler keeps the number actually in flight at or below it
+        maxWorkers = max(1, int(maxWorkers))
+        apiCalls.scheduler.setMaxConcurrency(maxWorkers)
+        if maxWorkers != self.maxWorkers:
+            self.maxWorkers = maxWorkers
+            self.session.close()
+            self.session = self.makeSession(maxWorkers)
+
+    def setBaseUrl(url):
+        # send requests to another navigator server, such as an onavMock
+        # instance; apiCalls created afterwards use it for plots too
+        apiCalls.baseUrl = url.rstrip('/')
+
+    def log(self, message, level=logging.INFO):
+        apiCalls.logTo(self.console, message, level)
+
+    def logTo(console, message, level=logging.INFO):
+        # console must be safe to call from worker threads (see LogBuffer);
+        # without one, messages at printLevel and above are printed
+        logger.log(level, message)
+        if console is not None:
+            console.append(message, level)
+        elif level >= apiCalls.printLevel:
+            with apiCalls.printLock:
+                print(message)
+
+    def timestamps(query, useCache=True):
+        # a fresh cached copy is returned without contacting the server
+        if useCache:
+            cached, fresh = apiCalls.metadataCache.lookup(apiCalls.baseUrl, 'timestamps', query['dataset'], query['variable'])
+            if fresh:
+                return cached
+
+        url = f"{apiCalls.baseUrl}/api/v1.0/timestamps/?dataset={query['dataset']}&variable={query['variable']}"
+
+        data_file = apiCalls.getMetadata('timestamps', url)
+
+        if data_file.status_code == 200:
+            data = data_file.json()
+            timestamps = {d['value'].replace('T', ' ').replace('+00:00', ' ') : d['id'] for d in data}
+            apiCalls.metadataCache.store(apiCalls.baseUrl, 'timestamps', query['dataset'], query['variable'], timestamps)
+            return timestamps
+
+    def depths(query, useCache=True):
+        if useCache:
+            cached, fresh = apiCalls.metadataCache.lookup(apiCalls.baseUrl, 'depth', query['dataset'], query['variable'])
+            if fresh:
+                return cached
+
+        url = f"{apiCalls.baseUrl}/api/v1.0/depth/?dataset={query['dataset']}&variable={query['variable']}"
+
+        data_file = apiCalls.getMetadata('depth', url)
+
+        if data_file.status_code == 200:
+            data = data_file.json()
+            if data:
+                depths = {d['value'] : d['id'] for d in data}
+                depths['Bottom'] = depths.pop('Bottom')
+            else:
+                depths = {'0 m' : 0}
+            apiCalls.metadataCache.store(apiCalls.baseUrl, 'depth', query['dataset'], query['variable'], depths)
+            return depths
+
+    def getMetadata(endpoint, url):
+        # timed GET of a small metadata response
+        record = apiCalls.telemetry.start(endpoint, url)
+        try:
+            with apiCalls.scheduler.slot(endpoint) as slot:
+                start = time.perf_counter()
+                data_file = apiCalls.metadataSession.get(url, timeout=30)
+                elapsed = data_file.elapsed.total_seconds()
+                record['ttfb'] = max(0.0, elapsed - Telemetry.connectionTime(record))
+                record['transfer'] = max(0.0, time.perf_counter() - start - elapsed)
+                slot['latency'] = record['ttfb']
+                slot['overloaded'] = data_file.status_code >= 500 or data_file.status_code == 429
+            record['status'] = data_file.status_code
+            record['bytes'] = len(data_file.content)
+            record['ok'] = data_file.status_code == 200
+            return data_file
+        finally:
+            apiCalls.telemetry.finish(record)
+
+    def metadata(query, useCache=True):
+        return apiCalls.timestamps(query, useCache), apiCalls.depths(query, useCache)
+
+    def cachedMetadata(query):
+        # whatever is on disk for this query, however old, as
+        # (timestamps, depths, fresh); None if either list is missing
+        timestamps, timestampsFresh = apiCalls.metadataCache.lookup(apiCalls.baseUrl, 'timestamps', query['dataset'], query['variable'])
+        depths, depthsFresh = apiCalls.metadataCache.lookup(apiCalls.baseUrl, 'depth', query['dataset'], query['variable'])
+        if timestamps is None or depths is None:
+            return None
+        return timestamps, depths, timestampsFresh and depthsFresh
+
+    def prefetchMetadata(pairs, maxWorkers=4, cancelEvent=None):
+        # load timestamps and depths for many (dataset, variable) pairs into
+        # the metadata cache, maxWorkers at a time (the size of the metadata
+        # connection pool). Pairs that are already fresh cost nothing.
+        # Returns the pairs that could not be loaded.
+        def fetch(pair):
+            if cancelEvent is not None and cancelEvent.is_set():
+                return True
+            try:
+                timestamps, depths = apiCalls.scheduler.runAt(RequestScheduler.BACKGROUND, apiCalls.metadata,
+                                                              {'dataset' : pair[0], 'variable' : pair[1]})
+            except (requests.RequestException, ValueError):
+                return False
+            return timestamps is not None and depths is not None
+
+        with ThreadPoolExecutor(max_workers=maxWorkers) as pool:
+            loaded = list(pool.map(fetch, pairs))
+        return [pair for pair, ok in zip(pairs, loaded) if not ok]
+
+    def retryDelay(self, attempt, response=None):
+        # exponential backoff with jitter, honouring a numeric Retry-After
+        if response is not None and response.headers.get('Retry-After', '').isdigit():
+            return min(self.maxBackoff, int(response.headers['Retry-After']))
+        return min(self.maxBackoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    def download(self, url, fileName, validate=None, kind='plot'):
+        # stream url to fileName + '.part' and rename it into place once it
+        # is complete and passes validate. Transient failures are retried
+        # with backoff, resuming from the bytes already on disk when the
+        # server honours Range requests. The response's ETag or
+        # Last-Modified is kept beside the .part and sent as If-Range, so a
+        # result that changed in the meantime is downloaded afresh rather
+        # than appended to. kind groups requests of similar cost for the
+        # scheduler's latency signal.
+        partName = fileName + '.part'
+        record = self.telemetry.start('plot', url)
+        try:
+            return self.downloadAttempts(url, fileName, partName, validate, record, kind)
+        finally:
+            self.telemetry.finish(record)
+
+    def downloadAttempts(self, url, fileName, partName, validate, record, kind):
+        validatorName = partName + '.validator'
+        validator = None
+        if os.path.exists(partName):
+            try:
+                with open(validatorName) as f:
+                    validator = f.read().strip() or None
+            except OSError:
+                pass
+            if validator is None:
+                # left by a run whose result can't be checked for changes
+                os.remove(partName)
+
+        delay = 0
+        for attempt in range(self.retries + 1):
+            record['retries'] = attempt
+            if attempt:
+                time.sleep(delay)
+                record['backoff'] += delay
+
+            offset = os.path.getsize(partName) if os.path.exists(partName) else 0
+            # ranges are only meaningful on the unencoded body
+            headers = {'Accept-Encoding' : 'identity'}
+            if offset:
+                headers['Range'] = f'bytes={offset}-'
+                if validator is not None:
+                    headers['If-Range'] = validator
+
+            try:
+                connected = Telemetry.connectionTime(record)
+                with self.scheduler.slot(kind) as slot, \
+                        self.session.get(url, stream=True, timeout=self.timeout, headers=headers) as data_file:
+                    record['status'] = data_file.status_code
+                    elapsed = data_file.elapsed.total_seconds()
+                    slot['latency'] = max(0.0, elapsed - (Telemetry.connectionTime(record) - connected))
+                    slot['overloaded'] = data_file.status_code in self.retryStatus
+                    record['ttfb'] += slot['latency']
+                    if data_file.status_code == 416:
+                        # our partial file is no use to the server; start over
+                        self.removePart(partName)
+                        delay = 0
+                        continue
+                    if data_file.status_code in self.retryStatus:
+                        delay = self.retryDelay(attempt, data_file)
+                        self.log(f'HTTP {data_file.status_code}, retrying {fileName} in {delay:.1f} s', logging.WARNING)
+                        continue
+                    if data_file.status_code not in (200, 206):
+                        return False
+
+                    if data_file.status_code == 206:
+                        self.log(f'Resuming {fileName} from byte {offset}', logging.DEBUG)
+                        mode = 'ab'
+                        expected = offset
+                    else:
+                        mode = 'wb'
+                        expected = 0
+                        # weak ETags can't be used with If-Range
+                        validator = data_file.headers.get('ETag')
+                        if validator is None or validator.startswith('W/'):
+                            validator = data_file.headers.get('Last-Modified')
+                        if validator is not None:
+                            with open(validatorName, 'w') as f:
+                                f.write(validator)
+                        elif os.path.exists(validatorName):
+                            os.remove(validatorName)
+
+                    length = data_file.headers.get('Content-Length')
+                    start = time.perf_counter()
+                    try:
+                        with open(partName, mode) as f:
+                            for chunk in data_file.iter_content(64 * 1024):
+                                f.write(chunk)
+                                record['bytes'] += len(chunk)
+                    finally:
+                        record['transfer'] += time.perf_counter() - start
+
+                    if length is not None and os.path.getsize(partName) != expected + int(length):
+                        raise requests.exceptions.ChunkedEncodingError('Response ended early.')
+
+                if validate is not None:
+                    start = time.perf_counter()
+                    try:
+                        validate(partName)
+                    except ValueError:
+                        # a bad body is not worth resuming
+                        self.removePart(partName)
+                        raise
+                    finally:
+                        record['validate'] += time.perf_counter() - start
+
+                os.replace(partName, fileName)
+                if os.path.exists(validatorName):
+                    os.remove(validatorName)
+                record['ok'] = True
+                return True
+
+            except (requests.ConnectionError, requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError, ValueError) as e:
+                delay = self.retryDelay(attempt)
+                self.log(f'{type(e).__name__}, retrying {fileName} in {delay:.1f} s', logging.WARNING)
+
+        # leave any partial file behind so the next attempt can resume it
+        return False
+
+    def removePart(self, partName):
+        # a partial download and the validator saved with it
+        for name in (partName, partName + '.validator'):
+            if os.path.exists(name):
+                os.remove(name)
+
+    def checkPng(self, fileName):
+        # cheap structural check: PNG signature followed by an IHDR chunk
+        with open(fileName, 'rb') as f:
+            header = f.read(16)
+        if header[:8] != b'\x89PNG\r\n\x1a\n' or header[12:16] != b'IHDR':
+            raise ValueError('Response is not a PNG image.')
+
+        # full decode is opt-in since it costs as much as the download
+        if self.verifyPng:
+            from PIL import Image
+            with Image.open(fileName) as img:
+                img.verify()
+
+    def cached(self, query, outputFormat, fileName):
+        # serve an identical earlier request from the result cache
+        key = self.resultCache.key(self.base_plot_url, query, outputFormat, self.dpi)
+        if self.resultCache.fetch(key, outputFormat, fileName + '.' + outputFormat, query.get('quantum')):
+            self.log('Saved ' + fileName + '.' + outputFormat + ' from cache', logging.DEBUG)
+            return key, True
+        return key, False
+
+    def csv(self, query, fileName):
+        key, hit = self.cached(query, 'csv', fileName)
+        if hit:
+            return True
+
+        url = self.base_plot_url + urlencode({'query': json.dumps(query)}) + '&save&format=csv&size=10x7&dpi=' + str(self.dpi)
+        self.log(url, logging.DEBUG)
+
+        # Save file and finish
+        self.log('Saving as ' + fileName + '.csv', logging.DEBUG)
+        try:
+            ok = self.download(url, fileName + '.csv', kind=f"{query.get('type')} csv")
+        except (requests.RequestException, OSError):
+            ok = False
+        if not ok:
+            self.log(f'Could not complete request for {fileName}.', logging.ERROR)
+            return False
+
+        self.log('Done', logging.DEBUG)
+        self.resultCache.add(key, 'csv', fileName + '.csv')
+        return True
+
+    def png(self, query, fileName):
+        key, hit = self.cached(query, 'png', fileName)
+        if hit:
+            return True
+
+        # Assemble full request
+        url = self.base_plot_url + urlencode({'query': json.dumps(query)}) + '&dpi=' + str(self.dpi)
+        self.log(url, logging.DEBUG)
+
+        # Save file and finish; the server already sends PNG bytes, so they
+        # are written as-is
+        self.log('Saving as ' + fileName + '.png', logging.DEBUG)
+        try:
+            ok = self.download(url, fileName + '.png', self.checkPng, f"{query.get('type')} png")
+        except (requests.RequestException, OSError):
+            ok = False
+        if not ok:
+            self.log(f'Could not complete request for {fileName}.', logging.ERROR)
+            return False
+
+        self.log('Done', logging.DEBUG)
+        self.resultCache.add(key, 'png', fileName + '.png')
+        return True
+
+    def columnarBatch(self, jobs, path, progress=None, cancelEvent=None):
+        # download jobs as CSV and merge them all into one ColumnarStore
+        store = ColumnarStore(path)
+        try:
+            summary = self.batch(jobs, 'CSV', progress, cancelEvent, store)
+        finally:
+            store.close()
+        self.log(f'Saved {store.rows} rows from {len(store.stations)} stations to {store.path}.npy')
+        return summary
+
+    def uniqueJobs(self, jobs):
+        # drop jobs repeated with the same query and fileName (a station
+        # pasted twice) and give a numbered fileName to a different query
+        # that would save to a file already taken; returns (jobs to fetch,
+        # {fileName : how many more times it was asked for})
+        unique = []
+        queries = {}
+        repeats = {}
+        for query, fileName in jobs:
+            text = json.dumps(query, sort_keys=True)
+            name = fileName
+            n = 1
+            while name in queries and queries[name] != text:
+                name = f'{fileName}_{n}'
+                n += 1
+            if name in queries:
+                repeats[name] = repeats.get(name, 0) + 1
+                continue
+            queries[name] = text
+            unique.append((query, name))
+
+        if repeats:
+            self.log(f'{sum(repeats.values())} jobs repeat an earlier one; sending {len(unique)} requests for {len(jobs)} jobs.')
+        return unique, repeats
+
+    def gridDedupe(self, jobs):
+        # collapse single-station jobs whose stations fall in the same model
+        # grid cell into one job; returns (jobs to fetch, {fileName : [the
+        # other fileNames that should get a copy of its result]})
+        unique = []
+        copies = {}
+        seen = {}
+        for query, fileName in jobs:
+            station = query.get('station')
+            dataset = query.get('dataset')
+            if not station or len(station) != 1:
+                unique.append((query, fileName))
+                continue
+
+            if dataset not in self.gridIndexes:
+                index = GridIndex(dataset)
+                available = index.available()
+                self.gridIndexes[dataset] = index if available else None
+                if not available:
+                    self.log(f'No grid file for {dataset} at {index.gridFile}; not merging stations.', logging.WARNING)
+            index = self.gridIndexes[dataset]
+            cell = index.nearest(*station[0]) if index is not None else None
+            if cell is None:
+                unique.append((query, fileName))
+                continue
+
+            rest = dict(query)
+            del rest['station']
+            key = (dataset, cell, json.dumps(rest, sort_keys=True))
+            if key in seen:
+                copies[seen[key]].append(fileName)
+            else:
+                seen[key] = fileName
+                copies[fileName] = []
+                unique.append((query, fileName))
+
+        merged = sum(len(v) for v in copies.values())
+        if merged:
+            self.log(f'{merged} stations share a grid cell with another; sending {len(unique)} requests for {len(jobs)} stations.')
+        return unique, {k : v for k, v in copies.items() if v}
+
+    def finishJob(self, fileName, result, extension, summary, copies, store, variables=None, query=None):
+        # record a job's outcome, hand its file to every station merged into
+        # it, and move the results into the columnar store if there is one
+        # (or split them per variable)
+        names = [fileName]
+        for other in copies.get(fileName, []):
+            if result == 'succeeded':
+                try:
+                    shutil.copyfile(fileName + extension, other + extension)
+                except OSError as e:
+                    self.log(f'{other}: {e}', logging.ERROR)
+                    summary['failed'].append(other)
+                    continue
+            names.append(other)
+
+        for name in names:
+            summary[result].append(name)
+            if store is not None and result == 'succeeded':
+                self.storeResult(store, name + extension, query)
+            elif variables and result == 'succeeded':
+                self.splitVariableCsv(name + extension, variables)
+
+    def splitVariableCsv(self, fileName, variables):
+        # rewrite a multi-variable CSV as one file per variable, each with
+        # the coordinate columns plus that variable's column. The value
+        # columns are matched to the requested variables in order.
+        with open(fileName, newline='') as f:
+            lines = f.readlines()
+
+        comments = [line for line in lines if line.startswith('//')]
+        rows = [line.rstrip('\r\n').split(',') for line in lines if line.strip() and not line.startswith('//')]
+        if not rows:
+            return
+
+        header = [c.strip().lower() for c in rows[0]]
+        keep = [k for k, c in enumerate(header) if c.startswith(('lat', 'lon', 'depth', 'time', 'date', 'station'))]
+        values = [k for k in range(len(header)) if k not in keep]
+        if len(values) != len(variables):
+            self.log(f'{fileName}: expected {len(variables)} variable columns, found {len(values)}; not split.', logging.WARNING)
+            return
+
+        base, extension = os.path.splitext(fileName)
+        joined = '-'.join(variables)
+        for variable, column in zip(variables, values):
+            name = base.replace(joined, variable, 1) if joined in base else base + '_' + variable
+            with open(name + extension, 'w', newline='') as f:
+                f.writelines(comments)
+                for row in rows:
+                    f.write(','.join([row[k] for k in keep] + [row[column]]) + '\n')
+        os.remove(fileName)
+
+    def storeResult(self, store, fileName, query=None):
+        # profile CSVs have no time column; their rows get the time the
+        # query asked for, as listed in the dataset's cached timestamps
+        time = None
+        if query is not None and 'time' in query:
+            timestamps, _ = apiCalls.metadataCache.lookup(apiCalls.baseUrl, 'timestamps', query['dataset'],
+                                                          query['variable'][0] if isinstance(query['variable'], list)
+                                                          else query['variable'])
+            time = next((text for text, t in (timestamps or {}).items() if t == query['time']), None)
+        try:
+            store.append(os.path.splitext(os.path.basename(fileName))[0], fileName, time)
+            os.remove(fileName)
+        except (OSError, ValueError) as e:
+            # keep the CSV if it could not be converted
+            self.log(f'Could not add {fileName} to {store.path}.npy: {e}', logging.ERROR)
+
+    def timeChunks(self, query):
+        # split a long timeseries query into sub-windows of timeChunkSize
+        # timestamps, using the dataset's cached timestamp ids for the
+        # boundaries between chunks; returns None when the query is short
+        # enough to send as it is
+        if self.timeChunkSize <= 0 or query.get('type') != 'timeseries':
+            return None
+
+        timestamps, _ = apiCalls.metadataCache.lookup(apiCalls.baseUrl, 'timestamps', query['dataset'], query['variable'])
+        if not timestamps:
+            return None
+
+        ids = sorted(t for t in timestamps.values() if query['starttime'] <= t <= query['endtime'])
+        if len(ids) <= self.timeChunkSize:
+            return None
+
+        chunks = []
+        for i in range(0, len(ids), self.timeChunkSize):
+            chunk = dict(query)
+            chunk['starttime'] = ids[i]
+            chunk['endtime'] = ids[min(i + self.timeChunkSize, len(ids)) - 1]
+            chunks.append(chunk)
+
+        # the cached list may have moved on since the times were picked, so
+        # the outer bounds are the query's own, not the nearest cached ids
+        chunks[0]['starttime'] = query['starttime']
+        chunks[-1]['endtime'] = query['endtime']
+        return chunks
+
+    def areaTiles(self, query):
+        # split an area query into a tileGrid of sub-polygons, each tile's
+        # box grown by tileOverlap of its size so edge cells are covered;
+        # returns [(query, (row, col))] or None when tiling is off
+        rows, cols = self.tileGrid
+        if rows * cols <= 1 or query.get('type') != 'map':
+            return None
+
+        polygon = query['area'][0]['polygons'][0]
+        lats = [p[0] for p in polygon]
+        lons = [p[1] for p in polygon]
+        tileHeight = (max(lats) - min(lats)) / rows
+        tileWidth = (max(lons) - min(lons)) / cols
+
+        tiles = []
+        for row in range(rows):
+            north = max(lats) - row * tileHeight
+            for col in range(cols):
+                west = min(lons) + col * tileWidth
+                clipped = clipPolygon(polygon,
+                                      north - tileHeight - self.tileOverlap * tileHeight,
+                                      north + self.tileOverlap * tileHeight,
+                                      west - self.tileOverlap * tileWidth,
+                                      west + tileWidth + self.tileOverlap * tileWidth)
+                if len(clipped) < 3:
+                    continue
+
+                tile = json.loads(json.dumps(query))
+                tile['area'][0]['polygons'] = [clipped]
+                tiles.append((tile, (row, col)))
+
+        return tiles
+
+    def splitJob(self, query, outputFormat):
+        # (sub-queries, merge function) for a job that should be fetched in
+        # parts, or None to send it as a single request
+        if outputFormat == 'CSV':
+            chunks = self.timeChunks(query)
+            if chunks:
+                return chunks, self.stitchCsv
+
+            # rendered maps each have their own title, axes and colour
+            # scale, so PNG areas are always fetched whole
+            tiles = self.areaTiles(query)
+            if tiles:
+                queries = [tile for tile, _ in tiles]
+                positions = [position for _, position in tiles]
+                return queries, lambda partFiles, fileName: self.mergeCsvTiles(partFiles, fileName, query, positions)
+
+        return None
+
+    def tileLocator(self, query):
+        # function giving the (row, col) of the tile whose un-overlapped box
+        # holds a lat/lon, counting rows from the north as areaTiles does
+        rows, cols = self.tileGrid
+        polygon = query['area'][0]['polygons'][0]
+        north = max(p[0] for p in polygon)
+        west = min(p[1] for p in polygon)
+        tileHeight = (north - min(p[0] for p in polygon)) / rows
+        tileWidth = (max(p[1] for p in polygon) - west) / cols
+
+        def tileAt(lat, lon):
+            row = int((north - lat) / tileHeight)
+            col = int((lon - west) / tileWidth)
+            return min(max(row, 0), rows - 1), min(max(col, 0), cols - 1)
+        return tileAt
+
+    def mergeCsvTiles(self, partFiles, fileName, query, positions):
+        # join tile CSVs, keeping from each tile only the rows inside its own
+        # un-overlapped box. The server grids every tile from that tile's
+        # bounds, so points in the overlap don't match between tiles and
+        # can't be matched up by value.
+        tileAt = self.tileLocator(query)
+        directory = os.path.dirname(os.path.abspath(fileName))
+        fd, tmpName = tempfile.mkstemp(dir=directory, suffix='.part')
+        try:
+            with os.fdopen(fd, 'w', newline='') as dst:
+                for i, part in enumerate(partFiles):
+                    with open(part, newline='') as src:
+                        latLon = None
+                        for line in src:
+                            if latLon is None:
+                                # comments and the column names come first
+                                if line.startswith('//') or not line.strip():
+                                    if i == 0:
+                                        dst.write(line)
+                                    continue
+                                columns = [c.strip().lower() for c in line.split(',')]
+                                latLon = [next((k for k, c in enumerate(columns) if c.startswith(prefix)), None)
+                                          for prefix in ('lat', 'lon')]
+                                if i == 0:
+                                    dst.write(line)
+                                continue
+
+                            if None not in latLon:
+                                fields = line.rstrip('\r\n').split(',')
+                                try:
+                                    if tileAt(float(fields[latLon[0]]), float(fields[latLon[1]])) != positions[i]:
+                                        continue
+                                except (IndexError, ValueError):
+                                    pass
+                            dst.write(line if line.endswith('\n') else line + '\n')
+            os.replace(tmpName, fileName)
+        except BaseException:
+            if os.path.exists(tmpName):
+                os.remove(tmpName)
+            raise
+
+    def stitchCsv(self, partFiles, fileName):
+        # concatenate chunk CSVs in order, keeping only the first header
+        directory = os.path.dirname(os.path.abspath(fileName))
+        fd, tmpName = tempfile.mkstemp(dir=directory, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as dst:
+                for i, part in enumerate(partFiles):
+                    with open(part, 'rb') as src:
+                        if i > 0:
+                            # skip the // comment lines and the column names
+                            line = src.readline()
+                            while line.startswith(b'//') or (line and not line.strip()):
+                                line = src.readline()
+                        shutil.copyfileobj(src, dst, 1024 * 1024)
+
+                        if src.tell() > 0:
+                            src.seek(-1, os.SEEK_END)
+                            if src.read(1) != b'\n':
+                                dst.write(b'\n')
+            os.replace(tmpName, fileName)
+        except BaseException:
+            if os.path.exists(tmpName):
+                os.remove(tmpName)
+            raise
+
+    def batch(self, jobs, outputFormat, progress=None, cancelEvent=None, store=None):
+        # run a list of (query, fileName) jobs on a bounded worker pool and
+        # return a summary of which files were saved and which failed. With
+        # a ColumnarStore, successful CSVs are moved into the store.
+        fetch = self.csv if outputFormat == 'CSV' else self.png
+        summary = {'succeeded' : [], 'failed' : [], 'cancelled' : []}
+        hits, misses = self.resultCache.hits, self.resultCache.misses
+        firstRecord = self.telemetry.count
+
+        # long timeseries and large areas are fetched as several part files
+        # and merged once every part has arrived
+        extension = '.' + outputFormat.lower()
+        jobs, repeats = self.uniqueJobs(jobs)
+        copies = {}
+        if self.snapToGrid:
+            jobs, copies = self.gridDedupe(jobs)
+
+        tasks = []
+        split = {}
+        for query, fileName in jobs:
+            parts = self.splitJob(query, outputFormat)
+            if parts:
+                subQueries, merge = parts
+                split[fileName] = ([f'{fileName}.part{i}' for i in range(len(subQueries))], merge)
+                tasks.extend(zip(subQueries, split[fileName][0]))
+            else:
+                tasks.append((query, fileName))
+
+        status = {}
+        with ThreadPoolExecutor(max_workers=self.maxWorkers) as pool:
+            # a lone request is as urgent as a metadata lookup; bigger
+            # batches yield to both
+            priority = RequestScheduler.INTERACTIVE if len(tasks) == 1 else RequestScheduler.BULK
+            futures = {pool.submit(self.scheduler.runAt, priority, fetch, query, fileName) : fileName
+                       for query, fileName in tasks}
+            for done, future in enumerate(as_completed(futures), 1):
+                if cancelEvent is not None and cancelEvent.is_set():
+                    # requests already in flight are allowed to finish
+                    for pending in futures:
+                        pending.cancel()
+                if progress is not None:
+                    progress(done, len(futures))
+                try:
+                    ok = future.result()
+                except CancelledError:
+                    status[futures[future]] = 'cancelled'
+                    continue
+                except Exception as e:
+                    self.log(f'{futures[future]}: {e}', logging.ERROR)
+                    ok = False
+                status[futures[future]] = 'succeeded' if ok else 'failed'
+
+        for query, fileName in jobs:
+            # multi-variable profiles can be written out one file per variable
+            variables = None
+            if self.splitVariables and outputFormat == 'CSV' and query.get('type') == 'profile':
+                variables = query['variable'] if len(query['variable']) > 1 else None
+
+            if fileName not in split:
+                self.finishJob(fileName, status[fileName], extension, summary, copies, store, variables, query)
+                continue
+
+            # successful parts stay in the result cache, so a retry only
+            # downloads the parts that failed
+            parts, merge = split[fileName]
+            partStatus = [status[part] for part in parts]
+            if all(s == 'succeeded' for s in partStatus):
+                try:
+                    merge([part + extension for part in parts], fileName + extension)
+                    self.log(f'Joined {len(parts)} parts into {fileName}{extension}', logging.DEBUG)
+                    self.finishJob(fileName, 'succeeded', extension, summary, copies, store, variables, query)
+                except (OSError, ValueError) as e:
+                    self.log(f'{fileName}: {e}', logging.ERROR)
+                    self.finishJob(fileName, 'failed', extension, summary, copies, store)
+            elif 'failed' in partStatus:
+                self.log(f"{fileName}: {partStatus.count('failed')} of {len(parts)} parts failed", logging.ERROR)
+                self.finishJob(fileName, 'failed', extension, summary, copies, store)
+            else:
+                self.finishJob(fileName, 'cancelled', extension, summary, copies, store)
+
+            for part in parts:
+                if os.path.exists(part + extension):
+                    os.remove(part + extension)
+
+        # a repeated job shares the outcome of the one that was fetched
+        for fileName, count in repeats.items():
+            for result in ('succeeded', 'failed', 'cancelled'):
+                if fileName in summary[result]:
+                    summary[result].extend([fileName] * count)
+
+        self.log(f"Batch complete: {len(summary['succeeded'])} succeeded, {len(summary['failed'])} failed, {len(summary['cancelled'])} cancelled.")
+        summary['cacheHits'] = self.resultCache.hits - hits
+        summary['cacheMisses'] = self.resultCache.misses - misses
+        self.log(f"Result cache: {summary['cacheHits']} hits, {summary['cacheMisses']} misses.")
+        summary['telemetry'] = Telemetry.summarize(self.telemetry.since(firstRecord, 'plot'))
+        if summary['telemetry']['requests']:
+            for line in Telemetry.report(summary['telemetry']):
+                self.log(line)
+        if self.scheduler.adaptive:
+            summary['concurrency'] = self.scheduler.limit
+            self.log(f'Concurrency settled at {self.scheduler.limit:.1f} of {self.scheduler.maxConcurrency} requests.')
+        for fileName in summary['failed']:
+            self.log('Failed: ' + fileName, logging.ERROR)
+
+        return summary
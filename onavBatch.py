@@ -0,0 +1,301 @@
+import csv
+import json
+import logging
+import os
+import time
+
+import requests
+
+from onavAPI import (SyncManifest, apiCalls, areaJob, datasets, defaultUrl, mooringJob, profileJob,
+                     quantums, variables)
+
+# Headless batch runner. A job file is JSON of the form
+#
+#   {"output" : "results",
+#    "url" : "http://navigator.oceansdata.ca",
+#    "format" : "csv",
+#    "workers" : 8,
+#    "maxRate" : 20,
+#    "adaptive" : true,
+#    "timeChunkSize" : 48,
+#    "tiles" : [2, 3],
+#    "tileOverlap" : 0.1,
+#    "snapToGrid" : true,
+#    "splitVariables" : true,
+#    "verifyPng" : true,
+#    "metrics" : "metrics.jsonl",
+#    "requests" : [
+#       {"type" : "profile", "dataset" : "giops_day", "variable" : ["votemper", "vosaline"],
+#        "time" : "latest", "stations" : [[47.5, -52.7], [46.0, -50.0]]},
+#       {"type" : "timeseries", "dataset" : "riops_fc_3dps", "variable" : "vosaline",
+#        "starttime" : "first", "endtime" : "latest", "stations" : "stations.csv"},
+#       {"type" : "map", "dataset" : "giops_day", "variable" : "votemper", "time" : 2254,
+#        "polygon" : [[50, -60], [50, -50], [45, -50], [45, -60]],
+#        "arrows" : "magwatervel", "contour" : "none"}
+#    ]}
+#
+# Datasets and variables may be given by id or by their display name. Times
+# are timestamp ids, timestamp strings, or 'first'/'latest'. Stations are a
+# list of [lat, lon] pairs or the path of a CSV file with lat,lon columns.
+# "format" may also be set per request; "npy" requests are downloaded as
+# CSV and merged into one NumPy record array, <output>/<columnarName>.npy
+# (see ColumnarStore). timeChunkSize splits timeseries requests into
+# parallel sub-windows of that many timestamps, and tiles fetches CSV map
+# requests as a [rows, cols] grid of overlapping sub-polygons. snapToGrid
+# sends one request per model grid cell (see GridIndex) and copies the
+# result to every station in that cell. A profile "variable" may be a list,
+# fetched in one request per station; splitVariables writes the result as
+# one CSV per variable. verifyPng decodes every PNG in full before keeping
+# it, rather than only checking its header (--verify-png does the same for
+# every job file). url points the requests at another server, such as
+# onavMock.py; --url on the command line takes precedence. metrics appends
+# a JSON line of timings, size, status and retries for every request made
+# (see Telemetry). workers is the most requests ever in flight; with
+# adaptive (the default) the scheduler finds the number the server copes
+# with below that, and maxRate caps requests started per second (see
+# RequestScheduler).
+#
+# syncJobFile (--sync) runs a job file incrementally: each request covers
+# every time step from its "starttime" or "time" (default 'latest') on its
+# first sync up to the newest the server lists, and only steps without an
+# entry in <output>/<manifest> (default sync_manifest.json, see
+# SyncManifest) are fetched. Profiles and maps get one file per time step
+# and timeseries one file per station spanning the missing steps. With
+# --watch the sync repeats every so many minutes.
+
+
+def resolveDataset(value):
+    return datasets.get(value, value)
+
+def resolveVariable(dataset, value):
+    if isinstance(value, list):
+        return [resolveVariable(dataset, v) for v in value]
+    return variables.get(dataset, {}).get(value, value)
+
+def resolveTime(timestamps, value):
+    if isinstance(value, int):
+        return value
+    if value in ('first', 'earliest'):
+        return next(iter(timestamps.values()))
+    if value in ('last', 'latest'):
+        return list(timestamps.values())[-1]
+
+    times = {k.strip() : v for k, v in timestamps.items()}
+    key = value.replace('T', ' ').replace('+00:00', '').replace('Z', '').strip()
+    if key not in times:
+        raise ValueError(f'Timestamp {value} is not available.')
+    return times[key]
+
+def loadStations(value, baseDir):
+    if not isinstance(value, str):
+        return [[float(lat), float(lon)] for lat, lon in value]
+
+    stations = []
+    with open(os.path.join(baseDir, value), newline='') as f:
+        for row in csv.reader(f):
+            try:
+                stations.append([float(row[0]), float(row[1])])
+            except (IndexError, ValueError):
+                # header or blank line
+                continue
+    return stations
+
+def buildJobs(request, baseDir, outputDir):
+    # the same (query, fileName) jobs the GUI's makeAPICall builds
+    dataset = resolveDataset(request['dataset'])
+    variable = resolveVariable(dataset, request['variable'])
+    quantum = request.get('quantum', quantums.get(dataset))
+
+    # profiles may ask for several variables; their timestamps are shared
+    firstVariable = variable[0] if isinstance(variable, list) else variable
+    timestamps = apiCalls.timestamps({'dataset' : dataset, 'variable' : firstVariable})
+    if timestamps is None:
+        raise ValueError(f'Could not load timestamps for {dataset}/{variable}.')
+
+    jobs = []
+    if request['type'] == 'profile':
+        time = resolveTime(timestamps, request['time'])
+        for p in loadStations(request['stations'], baseDir):
+            jobs.append(profileJob(dataset, variable, quantum, time, p))
+
+    elif request['type'] == 'timeseries':
+        starttime = resolveTime(timestamps, request['starttime'])
+        endtime = resolveTime(timestamps, request['endtime'])
+        for p in loadStations(request['stations'], baseDir):
+            jobs.append(mooringJob(dataset, variable, quantum, starttime, endtime, p))
+
+    elif request['type'] == 'map':
+        time = resolveTime(timestamps, request['time'])
+        points = loadStations(request['polygon'], baseDir)
+        if len(points) < 3:
+            raise ValueError('An area needs at least 3 points.')
+        arrowVar = resolveVariable(dataset, request.get('arrows', 'none'))
+        contourVar = resolveVariable(dataset, request.get('contour', 'none'))
+        jobs.append(areaJob(dataset, variable, quantum, time, points, arrowVar, contourVar))
+
+    else:
+        raise ValueError(f"Unknown request type {request['type']}.")
+
+    return [(query, os.path.join(outputDir, fileName)) for query, fileName in jobs]
+
+def openJobFile(path, outputDir=None, workers=None, console=None, metrics=None):
+    # read a job file and set up an apiCalls as it asks; returns
+    # (spec, baseDir, outputDir, calls)
+    with open(path) as f:
+        spec = json.load(f)
+
+    baseDir = os.path.dirname(os.path.abspath(path))
+    outputDir = outputDir or os.path.join(baseDir, spec.get('output', '.'))
+    os.makedirs(outputDir, exist_ok=True)
+
+    if 'url' in spec and apiCalls.baseUrl == defaultUrl:
+        # --url on the command line wins over the job file
+        apiCalls.setBaseUrl(spec['url'])
+
+    calls = apiCalls(console, workers or spec.get('workers', 8))
+    apiCalls.scheduler.adaptive = spec.get('adaptive', True)
+    if 'maxRate' in spec and not apiCalls.scheduler.maxRate:
+        apiCalls.scheduler.maxRate = spec['maxRate']
+    calls.timeChunkSize = spec.get('timeChunkSize', 0)
+    calls.tileGrid = tuple(spec.get('tiles', (1, 1)))
+    calls.tileOverlap = spec.get('tileOverlap', 0.1)
+    calls.snapToGrid = spec.get('snapToGrid', False)
+    calls.splitVariables = spec.get('splitVariables', False)
+    calls.verifyPng = apiCalls.verifyPng or spec.get('verifyPng', False)
+    if metrics or spec.get('metrics'):
+        apiCalls.telemetry.path = metrics or os.path.join(baseDir, spec['metrics'])
+
+    return spec, baseDir, outputDir, calls
+
+def runBatches(calls, batches, columnarPath, summary):
+    # run {format : jobs} one format at a time, adding to summary
+    for fmt, jobs in batches.items():
+        if fmt == 'NPY':
+            result = calls.columnarBatch(jobs, columnarPath)
+        else:
+            result = calls.batch(jobs, fmt)
+        for k in summary:
+            summary[k].extend(result[k])
+    return summary
+
+def runJobFile(path, outputDir=None, workers=None, outputFormat=None, console=None, metrics=None):
+    # run every request in a job file and return the combined summary
+    spec, baseDir, outputDir, calls = openJobFile(path, outputDir, workers, console, metrics)
+
+    # group the jobs by output format so each format runs as one batch
+    batches = {}
+    summary = {'succeeded' : [], 'failed' : [], 'cancelled' : []}
+    for request in spec['requests']:
+        fmt = (outputFormat or request.get('format') or spec.get('format', 'csv')).upper()
+        try:
+            batches.setdefault(fmt, []).extend(buildJobs(request, baseDir, outputDir))
+        except (KeyError, ValueError, OSError) as e:
+            calls.log(f'Skipping request {request}: {e}', logging.ERROR)
+            summary['failed'].append(str(request))
+
+    return runBatches(calls, batches, os.path.join(outputDir, spec.get('columnarName', 'results')), summary)
+
+def buildSyncJobs(request, baseDir, outputDir, manifest):
+    # jobs for the time steps of a request that the manifest has no record
+    # of, as (query, fileName, manifest keys)
+    dataset = resolveDataset(request['dataset'])
+    variable = resolveVariable(dataset, request['variable'])
+    quantum = request.get('quantum', quantums.get(dataset))
+
+    # always ask the server, as new time steps are the point
+    firstVariable = variable[0] if isinstance(variable, list) else variable
+    timestamps = apiCalls.timestamps({'dataset' : dataset, 'variable' : firstVariable}, False)
+    if timestamps is None:
+        raise ValueError(f'Could not load timestamps for {dataset}/{variable}.')
+
+    # the first sync of a request starts at its "starttime" or "time"
+    # ('latest' if neither is given); later syncs carry on from there
+    start = resolveTime(timestamps, request.get('starttime', request.get('time', 'latest')))
+    start = manifest.start(request['type'], dataset, variable, start)
+    times = [t for t in timestamps.values() if t >= start]
+
+    jobs = []
+    if request['type'] == 'profile':
+        for p in loadStations(request['stations'], baseDir):
+            for t in times:
+                key = SyncManifest.key(dataset, variable, p, t)
+                if key not in manifest:
+                    query, fileName = profileJob(dataset, variable, quantum, t, p)
+                    jobs.append((query, fileName, [key]))
+
+    elif request['type'] == 'timeseries':
+        # one request per station spanning all of its missing time steps
+        for p in loadStations(request['stations'], baseDir):
+            missing = [t for t in times if SyncManifest.key(dataset, variable, p, t) not in manifest]
+            if missing:
+                query, fileName = mooringJob(dataset, variable, quantum, missing[0], missing[-1], p)
+                keys = [SyncManifest.key(dataset, variable, p, t) for t in times if missing[0] <= t <= missing[-1]]
+                jobs.append((query, fileName, keys))
+
+    elif request['type'] == 'map':
+        points = loadStations(request['polygon'], baseDir)
+        if len(points) < 3:
+            raise ValueError('An area needs at least 3 points.')
+        arrowVar = resolveVariable(dataset, request.get('arrows', 'none'))
+        contourVar = resolveVariable(dataset, request.get('contour', 'none'))
+        for t in times:
+            key = SyncManifest.key(dataset, variable, points, t)
+            if key not in manifest:
+                query, fileName = areaJob(dataset, variable, quantum, t, points, arrowVar, contourVar)
+                jobs.append((query, fileName, [key]))
+
+    else:
+        raise ValueError(f"Unknown request type {request['type']}.")
+
+    return [(query, os.path.join(outputDir, fileName), keys) for query, fileName, keys in jobs]
+
+def syncJobFile(path, outputDir=None, workers=None, outputFormat=None, console=None, metrics=None):
+    # fetch only the time steps published since the job file was last
+    # synced into this output directory, and return the summary
+    spec, baseDir, outputDir, calls = openJobFile(path, outputDir, workers, console, metrics)
+    manifest = SyncManifest(os.path.join(outputDir, spec.get('manifest', 'sync_manifest.json')))
+
+    batches = {}
+    keys = {}
+    summary = {'succeeded' : [], 'failed' : [], 'cancelled' : []}
+    for request in spec['requests']:
+        fmt = (outputFormat or request.get('format') or spec.get('format', 'csv')).upper()
+        try:
+            jobs = buildSyncJobs(request, baseDir, outputDir, manifest)
+        except (KeyError, ValueError, OSError, requests.RequestException) as e:
+            calls.log(f'Skipping request {request}: {e}', logging.ERROR)
+            summary['failed'].append(str(request))
+            continue
+        for query, fileName, jobKeys in jobs:
+            batches.setdefault(fmt, []).append((query, fileName))
+            keys[fileName] = (jobKeys, fmt)
+
+    count = sum(len(jobs) for jobs in batches.values())
+    calls.log(f'{count} requests for new time steps.' if count else 'Everything is up to date.')
+
+    # each sync gets an array of its own in NumPy mode
+    columnarPath = os.path.join(outputDir, '_'.join([spec.get('columnarName', 'results'),
+                                                     time.strftime('%Y%m%d%H%M%S')]))
+    runBatches(calls, batches, columnarPath, summary)
+
+    # only what arrived is recorded; failures are retried on the next sync
+    for fileName in summary['succeeded']:
+        if fileName in keys:
+            jobKeys, fmt = keys[fileName]
+            saved = columnarPath + '.npy' if fmt == 'NPY' else fileName + '.' + fmt.lower()
+            manifest.add(jobKeys, os.path.relpath(saved, outputDir))
+    manifest.save()
+
+    return summary
+
+def watchJobFile(path, interval, outputDir=None, workers=None, outputFormat=None, console=None, metrics=None):
+    # sync every interval minutes until interrupted; returns the last summary
+    summary = {'succeeded' : [], 'failed' : [], 'cancelled' : []}
+    try:
+        while True:
+            summary = syncJobFile(path, outputDir, workers, outputFormat, console, metrics)
+            apiCalls.logTo(console, f"Next check at {time.strftime('%H:%M', time.localtime(time.time() + interval * 60))}.")
+            time.sleep(interval * 60)
+    except KeyboardInterrupt:
+        apiCalls.logTo(console, 'Stopped watching.')
+    return summary
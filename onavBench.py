@@ -0,0 +1,297 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from onavAPI import (LogBuffer, MetadataCache, RequestScheduler, ResultCache, Telemetry, apiCalls, areaJob,
+                     mooringJob, profileJob, quantums, variables)
+from onavMock import MockNavigator
+
+# Offline benchmarks. Each case runs --repeat times against a local
+# MockNavigator (or the server given with --url) with its own empty caches,
+# output directory and request scheduler, and reports the best and median
+# wall time with the request telemetry and settled concurrency of the last
+# run:
+#
+#   python onavBench.py --latency 0.05 --payload-size 200000 --workers 8
+#   python onavBench.py --cases csv-batch,png-batch --json bench.jsonl --label v0.3
+#
+# --json appends one JSON line per case so runs of different releases can
+# be compared. The makeapicall case drives the real window through
+# Onav_lite.makeAPICall and is skipped when PySide2 is not available.
+
+dataset = 'giops_day'
+variable = 'votemper'
+
+
+def stationList(count, offset=0):
+    # points on a 1 degree grid off Newfoundland
+    return [[40.0 + (offset + k) % 10, -60.0 + (offset + k) // 10] for k in range(count)]
+
+class Benchmark():
+
+    def __init__(self, workers=4, stations=16, repeat=3, verbose=False):
+        self.workers = workers
+        self.stations = stations
+        self.repeat = repeat
+        self.verbose = verbose
+        self.results = []
+        self.run = 0
+
+    def setUp(self):
+        # scratch directory for output files and both caches
+        self.directory = tempfile.mkdtemp(prefix='onavbench')
+        self.cwd = os.getcwd()
+        self.metadataCache = apiCalls.metadataCache
+        apiCalls.metadataCache = MetadataCache(os.path.join(self.directory, 'metadata.json.gz'))
+        self.scheduler = apiCalls.scheduler
+        os.chdir(self.directory)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        apiCalls.metadataCache = self.metadataCache
+        apiCalls.scheduler = self.scheduler
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def makeCalls(self):
+        # an apiCalls with an empty result cache and output directory of its
+        # own, and a scheduler that has seen no requests yet; log lines are
+        # kept for a failed run instead of being printed
+        self.run += 1
+        apiCalls.scheduler = RequestScheduler(self.workers, maxRate=self.scheduler.maxRate,
+                                              adaptive=self.scheduler.adaptive)
+        runDirectory = os.path.join(self.directory, f'run{self.run}')
+        os.makedirs(runDirectory)
+        os.chdir(runDirectory)
+        console = None if self.verbose else LogBuffer(200)
+        return apiCalls(console, self.workers, ResultCache(os.path.join(runDirectory, 'cache')))
+
+    def query(self):
+        return {'dataset' : dataset, 'variable' : variable}
+
+    def measure(self, name, case):
+        # case(calls) runs once per repeat and returns a batch style summary
+        # of what it fetched, or None to skip the benchmark
+        times = []
+        for _ in range(self.repeat):
+            calls = self.makeCalls()
+            firstRecord = apiCalls.telemetry.count
+            start = time.perf_counter()
+            summary = case(calls)
+            times.append(time.perf_counter() - start)
+            if summary is None:
+                print(f'{name:<20} skipped')
+                return
+            if summary['failed']:
+                print(f"{name:<20} {len(summary['failed'])} of {len(summary['failed']) + len(summary['succeeded'])} failed")
+                if calls.console is not None:
+                    for _, _, message in calls.console.tail(limit=5):
+                        print('    ' + message)
+
+        stats = Telemetry.summarize(apiCalls.telemetry.since(firstRecord))
+        result = {'name' : name, 'runs' : [round(t, 4) for t in times],
+                  'best' : round(min(times), 4), 'median' : round(statistics.median(times), 4),
+                  'telemetry' : stats}
+        self.results.append(result)
+
+        line = f"{name:<20} best {result['best']:8.3f} s   median {result['median']:8.3f} s"
+        if stats['requests']:
+            line += (f"   {stats['requests']:4d} requests   p50 {stats['latency']['p50']:.3f} s"
+                     f"   {stats['throughput'] / 1e6:7.2f} MB/s")
+        if 'concurrency' in summary:
+            result['concurrency'] = summary['concurrency']
+            line += f"   limit {summary['concurrency']:.1f}"
+        print(line)
+
+    def outcome(self, results):
+        # a batch style summary from (name, ok) pairs
+        return {'succeeded' : [name for name, ok in results if ok],
+                'failed' : [name for name, ok in results if not ok]}
+
+    def metadata(self, calls, useCache=False):
+        # every dataset and variable, straight from the server
+        results = []
+        for ds in variables:
+            for var in variables[ds].values():
+                timestamps, depths = apiCalls.metadata({'dataset' : ds, 'variable' : var}, useCache)
+                results.append((f'{ds} {var}', timestamps is not None and depths is not None))
+        return self.outcome(results)
+
+    def metadataCached(self, calls):
+        return self.metadata(calls, True)
+
+    def mixed(self, calls):
+        # cold metadata, as the window loads at startup, then a batch. The
+        # metadata replies come back much sooner than plots do, and must
+        # not make the plots look slow to the scheduler.
+        self.metadata(calls)
+        return calls.batch(self.profileJobs(), 'CSV')
+
+    def csvSingle(self, calls):
+        query, fileName = profileJob(dataset, variable, quantums[dataset], self.latestTime(), stationList(1)[0])
+        return self.outcome([(fileName, calls.csv(query, fileName))])
+
+    def pngSingle(self, calls):
+        query, fileName = profileJob(dataset, variable, quantums[dataset], self.latestTime(), stationList(1)[0])
+        return self.outcome([(fileName, calls.png(query, fileName))])
+
+    def profileJobs(self):
+        return [profileJob(dataset, variable, quantums[dataset], self.latestTime(), p)
+                for p in stationList(self.stations)]
+
+    def csvBatch(self, calls):
+        return calls.batch(self.profileJobs(), 'CSV')
+
+    def pngBatch(self, calls):
+        return calls.batch(self.profileJobs(), 'PNG')
+
+    def cachedBatch(self, calls):
+        # the same batch twice; only the second, served from the result
+        # cache, is of interest but both are timed
+        jobs = self.profileJobs()
+        calls.batch(jobs, 'CSV')
+        return calls.batch(jobs, 'CSV')
+
+    def timeseriesChunked(self, calls):
+        timestamps = list(apiCalls.timestamps(self.query()).values())
+        calls.timeChunkSize = max(1, len(timestamps) // 8)
+        jobs = [mooringJob(dataset, variable, quantums[dataset], timestamps[0], timestamps[-1], p)
+                for p in stationList(max(1, self.stations // 4))]
+        return calls.batch(jobs, 'CSV')
+
+    def areaTiled(self, calls):
+        calls.tileGrid = (2, 2)
+        jobs = [areaJob(dataset, variable, quantums[dataset], self.latestTime(),
+                        [[50, -60], [50, -50], [45, -50], [45, -60]])]
+        return calls.batch(jobs, 'CSV')
+
+    def columnar(self, calls):
+        return calls.columnarBatch(self.profileJobs(), 'store')
+
+    def latestTime(self):
+        return list(apiCalls.timestamps(self.query()).values())[-1]
+
+    def makeAPICall(self, calls):
+        # end to end through the window: build the jobs from the coordinate
+        # table and wait for the batch worker to finish
+        try:
+            from PySide2.QtCore import QEventLoop
+            from PySide2.QtWidgets import QApplication
+            from onavGUI import Onav_lite
+        except ImportError:
+            return None
+
+        os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+        app = QApplication.instance() or QApplication(sys.argv[:1])
+
+        def waitFor(condition, timeout=300):
+            deadline = time.time() + timeout
+            while not condition() and time.time() < deadline:
+                app.processEvents(QEventLoop.AllEvents, 50)
+
+        window = Onav_lite()
+        try:
+            window.apiCalls.resultCache = calls.resultCache
+            waitFor(lambda: not window.metadataPending)
+            window.plotOptions.setCurrentIndex(0)
+            window.latlonModel.loadText('\n'.join(f'{lat},{lon}' for lat, lon in stationList(self.stations)))
+            window.outputCB.setCurrentText('CSV')
+            window.workersSB.setValue(self.workers)
+            window.makeAPICall()
+            waitFor(lambda: window.batchWorker is None)
+        finally:
+            window.close()
+
+        # the window writes one CSV per station to the working directory
+        saved = [name for name in os.listdir('.') if name.endswith('.csv')]
+        return self.outcome([(name, True) for name in saved] +
+                            [('missing', False)] * (self.stations - len(saved)))
+
+    cases = {'metadata' : metadata,
+             'metadata-cached' : metadataCached,
+             'mixed' : mixed,
+             'csv-single' : csvSingle,
+             'png-single' : pngSingle,
+             'csv-batch' : csvBatch,
+             'png-batch' : pngBatch,
+             'cached-batch' : cachedBatch,
+             'timeseries-chunked' : timeseriesChunked,
+             'area-tiled' : areaTiled,
+             'columnar' : columnar,
+             'makeapicall' : makeAPICall}
+
+    def runCases(self, names):
+        self.setUp()
+        try:
+            for name in names:
+                self.measure(name, lambda calls: Benchmark.cases[name](self, calls))
+        finally:
+            self.tearDown()
+        return self.results
+
+def main(argv=None):
+    argv = sys.argv if argv is None else argv
+
+    parser = argparse.ArgumentParser(description='Ocean Navigator Lite benchmarks')
+    parser.add_argument('--url', help='benchmark this server instead of a local mock')
+    parser.add_argument('--latency', type=float, default=0.02, help='mock response delay in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='extra random mock delay in seconds')
+    parser.add_argument('--render-time', type=float, default=0.1, help='further mock delay for plots in seconds')
+    parser.add_argument('--payload-size', type=int, default=50000, help='mock response size in bytes')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of mock requests failing with 503')
+    parser.add_argument('--capacity', type=int, default=0, help='mock concurrency before it slows down')
+    parser.add_argument('--max-rate', type=float, default=0, help='scheduler requests per second ceiling')
+    parser.add_argument('--fixed', action='store_true', help='keep concurrency at --workers instead of adapting')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--stations', type=int, default=16, help='stations per batch')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--cases', default=','.join(Benchmark.cases),
+                        help='comma separated subset of: ' + ', '.join(Benchmark.cases))
+    parser.add_argument('--json', metavar='FILE', help='append the results to FILE as JSON lines')
+    parser.add_argument('--label', default='', help='recorded with --json results, e.g. a version')
+    parser.add_argument('--verbose', action='store_true', help='print every request')
+    args = parser.parse_args(argv[1:])
+
+    if args.verbose:
+        apiCalls.printLevel = logging.DEBUG
+
+    names = [name.strip() for name in args.cases.split(',') if name.strip()]
+    unknown = [name for name in names if name not in Benchmark.cases]
+    if unknown:
+        parser.error('unknown case ' + ', '.join(unknown))
+
+    server = None
+    if args.url is None:
+        server = MockNavigator(latency=args.latency, jitter=args.jitter, payloadSize=args.payload_size,
+                               errorRate=args.error_rate, capacity=args.capacity,
+                               renderTime=args.render_time).start()
+        url = server.url
+    else:
+        url = args.url
+    baseUrl = apiCalls.baseUrl
+    apiCalls.setBaseUrl(url)
+    apiCalls.scheduler.maxRate = args.max_rate
+    apiCalls.scheduler.adaptive = not args.fixed
+
+    try:
+        results = Benchmark(args.workers, args.stations, args.repeat, args.verbose).runCases(names)
+    finally:
+        apiCalls.setBaseUrl(baseUrl)
+        if server is not None:
+            server.stop()
+
+    if args.json:
+        settings = {k : v for k, v in vars(args).items() if k not in ('json', 'cases', 'verbose')}
+        with open(args.json, 'a') as f:
+            for result in results:
+                f.write(json.dumps(dict(result, time=time.time(), python=platform.python_version(),
+                                        settings=settings)) + '\n')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,927 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import numpy as np
+from PySide2.QtCore import (QAbstractTableModel, QModelIndex, QObject,
+                            QRunnable, Qt, QThreadPool, QTimer, Signal)
+from PySide2.QtGui import QBrush, QColor, QIcon, QKeySequence
+from PySide2.QtWidgets import (QApplication, QCheckBox, QComboBox, QFileDialog,
+                               QFrame, QHBoxLayout, QLabel, QListWidget,
+                               QListWidgetItem, QMainWindow, QProgressBar,
+                               QPlainTextEdit, QPushButton, QScrollArea,
+                               QSpinBox, QTableView, QTabWidget, QVBoxLayout,
+                               QWidget)
+
+from onavAPI import (LogBuffer, apiCalls, areaJob, datasets, logger, mooringJob, profileJob,
+                     quantums, setLogFile, variables)
+
+# where 'Log to file' keeps every message, rotated at 1 MB
+logFileName = os.path.join(os.path.expanduser('~'), '.onavlite', 'onavlite.log')
+
+class CoordinateModel(QAbstractTableModel):
+    # lat/lon table backed by NumPy arrays. Each cell is either empty, a
+    # parsed number, or text that failed to parse (kept so it can be shown
+    # and reported); validation runs over whole columns at once.
+
+    EMPTY, VALID, INVALID = 0, 1, 2
+    headers = ['Latitude', 'Longitude']
+    limits = [(-90, 90), (-180, 360)]
+
+    def __init__(self, rows=1, parent=None):
+        super(CoordinateModel, self).__init__(parent)
+        self.values = np.full((rows, 2), np.nan)
+        self.state = np.zeros((rows, 2), dtype=np.int8)
+        self.badText = {}
+        # bad rows are highlighted; recomputed lazily after every change
+        self.badRowSet = None
+        self.modelReset.connect(self.clearBadRows)
+        self.dataChanged.connect(self.clearBadRows)
+
+    def clearBadRows(self, *args):
+        self.badRowSet = None
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.values)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else 2
+
+    def data(self, index, role=Qt.DisplayRole):
+        row, col = index.row(), index.column()
+        if role in (Qt.DisplayRole, Qt.EditRole):
+            if self.state[row, col] == self.VALID:
+                value = float(self.values[row, col])
+                # the editor gets every digit so that saving an untouched
+                # cell doesn't round the coordinate; the table shows up to
+                # 6 decimal places, about 0.1 m
+                if role == Qt.EditRole:
+                    return repr(value)
+                return f'{value:.6f}'.rstrip('0').rstrip('.')
+            return self.badText.get((row, col), '')
+        if role == Qt.BackgroundRole:
+            if self.badRowSet is None:
+                self.badRowSet = set(self.badRows().tolist())
+            if row in self.badRowSet:
+                return QBrush(QColor('#f8d7da'))
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return self.headers[section]
+        return str(section + 1)
+
+    def flags(self, index):
+        return super(CoordinateModel, self).flags(index) | Qt.ItemIsEditable
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if role != Qt.EditRole:
+            return False
+        row, col = index.row(), index.column()
+        text = str(value).strip()
+        self.badText.pop((row, col), None)
+        if not text:
+            self.values[row, col] = np.nan
+            self.state[row, col] = self.EMPTY
+        else:
+            try:
+                self.values[row, col] = float(text)
+                self.state[row, col] = self.VALID
+            except ValueError:
+                self.values[row, col] = np.nan
+                self.state[row, col] = self.INVALID
+                self.badText[(row, col)] = text
+        self.dataChanged.emit(self.index(row, 0), self.index(row, 1))
+        return True
+
+    def setRowCount(self, rows):
+        # grow or shrink the table, keeping the rows that remain
+        rows = max(rows, 0)
+        current = len(self.values)
+        if rows == current:
+            return
+        self.beginResetModel()
+        if rows < current:
+            self.values = self.values[:rows].copy()
+            self.state = self.state[:rows].copy()
+            self.badText = {k : v for k, v in self.badText.items() if k[0] < rows}
+        else:
+            self.values = np.vstack([self.values, np.full((rows - current, 2), np.nan)])
+            self.state = np.vstack([self.state, np.zeros((rows - current, 2), dtype=np.int8)])
+        self.endResetModel()
+
+    def setPoints(self, values, state, badText=None, startRow=0):
+        # replace rows from startRow on with a parsed block
+        self.beginResetModel()
+        rows = max(len(self.values), startRow + len(values))
+        if rows > len(self.values):
+            self.values = np.vstack([self.values, np.full((rows - len(self.values), 2), np.nan)])
+            self.state = np.vstack([self.state, np.zeros((rows - len(self.state), 2), dtype=np.int8)])
+        self.values[startRow:startRow + len(values)] = values
+        self.state[startRow:startRow + len(values)] = state
+        self.badText = {k : v for k, v in self.badText.items()
+                        if not startRow <= k[0] < startRow + len(values)}
+        for (row, col), text in (badText or {}).items():
+            self.badText[(row + startRow, col)] = text
+        self.endResetModel()
+
+    def loadText(self, text, startRow=0):
+        # parse pasted or imported lat/lon text: one point per line, comma,
+        # semicolon, tab or space separated; a header line is skipped
+        lines = [line for line in text.splitlines() if line.strip()]
+        cells = [(re.split(r'[,;\t ]+', line.strip()) + ['', ''])[:2] for line in lines]
+        if not cells:
+            return 0
+        cells = np.array(cells, dtype=str)
+
+        values, state, badText = self.parseCells(cells)
+        if state[0].tolist() == [self.INVALID, self.INVALID]:
+            values, state = values[1:], state[1:]
+            badText = {(r - 1, c) : t for (r, c), t in badText.items() if r > 0}
+
+        self.setPoints(values, state, badText, startRow)
+        return len(values)
+
+    def loadGeoJSON(self, text):
+        # every vertex of every geometry, in file order; GeoJSON is lon/lat
+        coordinates = []
+
+        def flatten(c):
+            if c and isinstance(c[0], (int, float)):
+                coordinates.append(c[:2])
+            else:
+                for part in c:
+                    flatten(part)
+
+        def collect(geometry):
+            if geometry is None:
+                return
+            if geometry['type'] == 'GeometryCollection':
+                for g in geometry['geometries']:
+                    collect(g)
+            else:
+                flatten(geometry['coordinates'])
+
+        data = json.loads(text)
+        if data['type'] == 'FeatureCollection':
+            for feature in data['features']:
+                collect(feature['geometry'])
+        elif data['type'] == 'Feature':
+            collect(data['geometry'])
+        else:
+            collect(data)
+
+        values = np.array(coordinates, dtype=float)[:, ::-1] if coordinates else np.empty((0, 2))
+        self.beginResetModel()
+        self.values = values
+        self.state = np.full(values.shape, self.VALID, dtype=np.int8)
+        self.badText = {}
+        self.endResetModel()
+        return len(values)
+
+    def parseCells(self, cells):
+        # vectorised float conversion; only blocks containing bad text fall
+        # back to converting cell by cell
+        state = np.where(np.char.str_len(cells) == 0, self.EMPTY, self.VALID).astype(np.int8)
+        filled = np.where(state == self.EMPTY, 'nan', cells)
+        badText = {}
+        try:
+            values = filled.astype(float)
+        except ValueError:
+            values = np.full(cells.shape, np.nan)
+            for (row, col), text in np.ndenumerate(filled):
+                try:
+                    values[row, col] = float(text)
+                except ValueError:
+                    state[row, col] = self.INVALID
+                    badText[(row, col)] = str(text)
+        return values, state, badText
+
+    def badRows(self):
+        # rows with unparseable text or a coordinate out of range
+        lat, lon = self.values[:, 0], self.values[:, 1]
+        complete = (self.state == self.VALID).all(axis=1)
+        outOfRange = complete & ((lat < self.limits[0][0]) | (lat > self.limits[0][1]) |
+                                 (lon < self.limits[1][0]) | (lon > self.limits[1][1]))
+        return np.flatnonzero((self.state == self.INVALID).any(axis=1) | outOfRange)
+
+    def points(self):
+        # complete rows as [[lat, lon], ...] plus the indices of bad rows;
+        # rows with an empty cell are ignored
+        complete = (self.state == self.VALID).all(axis=1)
+        return self.values[complete].tolist(), self.badRows()
+
+class CoordinateView(QTableView):
+    # table view that pastes clipboard text into the model from the current row
+
+    def keyPressEvent(self, event):
+        if event.matches(QKeySequence.Paste):
+            row = max(self.currentIndex().row(), 0)
+            self.model().loadText(QApplication.clipboard().text(), row)
+            return
+        super(CoordinateView, self).keyPressEvent(event)
+
+class WorkerSignals(QObject):
+    result = Signal(object)
+    error = Signal(str)
+    progress = Signal(int, int)
+    finished = Signal()
+
+class Worker(QRunnable):
+    # runs fn(*args, **kwargs) on the Qt thread pool and reports back via signals
+
+    def __init__(self, fn, *args, **kwargs):
+        super(Worker, self).__init__()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = WorkerSignals()
+        self.cancelEvent = threading.Event()
+        self.setAutoDelete(False)
+
+    def run(self):
+        try:
+            result = self.fn(*self.args, **self.kwargs)
+        except Exception as e:
+            self.signals.error.emit(str(e))
+        else:
+            self.signals.result.emit(result)
+        finally:
+            self.signals.finished.emit()
+
+class Onav_lite(QMainWindow):
+
+    def __init__(self, parent=None):
+        super(Onav_lite, self).__init__(parent)
+        self.setWindowTitle("Ocean Navigator Lite")
+
+        # initialize dictionaries and variables for data
+        self.datasetDict = dict(datasets)
+
+        self.variableDict = {}
+        self.timestampDict = {}
+        self.depthDict = {}
+        self.quantum = []
+
+        # background workers; results from a superseded metadata request are
+        # recognised by their generation number and dropped
+        self.threadPool = QThreadPool.globalInstance()
+        self.metadataGeneration = 0
+        self.metadataPending = False
+        # Submit stays locked until the time and depth lists belong to the
+        # selected dataset and variable
+        self.metadataReady = False
+        self.batchWorker = None
+        self.workers = set()
+
+        # log lines from every thread go to a ring buffer that a timer
+        # copies into the console in one go, instead of one widget update
+        # per line
+        self.logBuffer = LogBuffer()
+        self.logCount = 0
+
+        # initialize app widgets
+        self.initUI()
+
+        self.logTimer = QTimer(self)
+        self.logTimer.setInterval(100)
+        self.logTimer.timeout.connect(self.flushLog)
+        self.logTimer.start()
+        self.apiCalls = apiCalls(self.logBuffer)
+
+        # keep the metadata of every dataset and variable warm in the cache,
+        # at startup and every prefetch interval, so changing either
+        # dropdown is answered from memory
+        self.prefetchWorker = None
+        self.prefetchTimer = QTimer(self)
+        self.prefetchTimer.setInterval(10 * 60 * 1000)
+        self.prefetchTimer.timeout.connect(self.prefetchMetadata)
+        self.prefetchTimer.start()
+        self.prefetchMetadata()
+
+        # set window size and background color
+        self.setFixedSize(640,660)
+        self.setStyleSheet('Background-Color: #ffffff')
+        self.setWindowIcon(QIcon('onavlite.ico'))
+
+        # display app
+        self.show() 
+
+    def initUI(self):
+
+        main = QWidget(self)
+        mainLayout = QVBoxLayout(main)
+        self.setCentralWidget(main)
+
+        optionsFrame = QFrame(main)
+        optionsLayout = QHBoxLayout(optionsFrame)
+        optionsLFrame = QFrame(optionsFrame)
+        optionsLLayout = QVBoxLayout(optionsLFrame)
+        optionsRFrame = QFrame(optionsFrame)
+        optionsRLayout = QVBoxLayout(optionsRFrame)
+        optionsLayout.addWidget(optionsLFrame)
+        optionsLayout.addWidget(optionsRFrame)
+
+        bottomFrame = QFrame(main)
+        bottomLayout = QVBoxLayout(bottomFrame)
+
+        mainLayout.addWidget(optionsFrame)
+        mainLayout.addWidget(bottomFrame)
+
+        dataPanel = QWidget(optionsLFrame)
+        dataPanel.setFixedWidth(270)
+        dataPanelLayout = QVBoxLayout(dataPanel)
+        dataPanelLayout.setContentsMargins(0,0,0,0)
+
+        dataHeader = QLabel(dataPanel)
+        dataHeader.setFixedWidth(270)
+        dataHeader.setFixedHeight(20)
+        dataHeader.setStyleSheet('background-color: #008cba; color : #ffffff;')
+        dataHeader.setAlignment(Qt.AlignCenter)
+        dataHeader.setText('Select Dataset')
+
+        self.datasetCB = QComboBox(dataPanel)
+        self.variableCB = QComboBox(dataPanel)
+        self.datasetCB.addItems(self.datasetDict.keys())
+        self.variableCB.addItems(self.variableDict.keys())
+        self.datasetCB.currentIndexChanged.connect(self.datasetChanged)
+        self.variableCB.currentIndexChanged.connect(self.variableChanged)
+
+        dataPanelLayout.addWidget(dataHeader)
+        dataPanelLayout.addWidget(self.datasetCB)
+        dataPanelLayout.addWidget(self.variableCB)
+        dataPanelLayout.addStretch()
+
+        locationPanel = QFrame(optionsRFrame)
+        locationPanelLayout = QVBoxLayout(locationPanel)
+        locationPanelLayout.setContentsMargins(0,0,0,0)
+
+        locationButtons = QWidget(locationPanel)
+        locationButtonsLayout = QHBoxLayout(locationButtons)
+        rowLabel = QLabel('Point Quantity', locationButtons)
+        addRowButton = QPushButton('+', locationButtons)
+        addRowButton.setStyleSheet('background-color: #008cba; color : #ffffff;')
+        addRowButton.setFixedSize(20,20)
+        addRowButton.clicked.connect(lambda: self.addRows())
+        subRowButton = QPushButton('-', locationButtons)
+        subRowButton.setStyleSheet('background-color: #008cba; color : #ffffff;')
+        subRowButton.setFixedSize(20,20)
+        subRowButton.clicked.connect(lambda: self.removeRows())
+        importButton = QPushButton('Import', locationButtons)
+        importButton.setStyleSheet('background-color: #008cba; color : #ffffff;')
+        importButton.setFixedHeight(20)
+        importButton.clicked.connect(lambda: self.importPoints())
+
+        locationButtonsLayout.addWidget(rowLabel)
+        locationButtonsLayout.addWidget(addRowButton)
+        locationButtonsLayout.addWidget(subRowButton)
+        locationButtonsLayout.addWidget(importButton)
+        locationButtonsLayout.addStretch()
+
+        locationHeader = QLabel(locationPanel)
+        locationHeader.setFixedWidth(270)
+        locationHeader.setFixedHeight(20)
+        locationHeader.setStyleSheet('background-color: #008cba; color : #ffffff;')
+        locationHeader.setAlignment(Qt.AlignCenter)
+        locationHeader.setText('Coordinates')
+
+        self.latlonModel = CoordinateModel(1, self)
+        self.latlonTable = CoordinateView(locationPanel)
+        self.latlonTable.setModel(self.latlonModel)
+        self.latlonTable.setFixedWidth(270)
+
+        locationPanelLayout.addWidget(locationHeader)
+        locationPanelLayout.addWidget(self.latlonTable)
+        locationPanelLayout.addWidget(locationButtons)
+
+        # send one request per model grid cell instead of per station
+        self.snapToGridCB = QCheckBox('One request per grid cell', locationPanel)
+        self.snapToGridCB.setToolTip('Stations in the same model grid cell share one request')
+        locationPanelLayout.addWidget(self.snapToGridCB)
+
+        profileWidget = QWidget()
+        profileWidgetLayout = QVBoxLayout(profileWidget)
+        profileStartTimeLabel = QLabel('Time', profileWidget)
+        self.profileStartTimeCB = QComboBox(profileWidget)
+
+        # extra variables to fetch in the same request as the selected one
+        profileVariablesLabel = QLabel('Additional Variables', profileWidget)
+        self.profileVariablesList = QListWidget(profileWidget)
+        self.profileSplitCB = QCheckBox('One file per variable', profileWidget)
+
+        profileWidgetLayout.addWidget(profileStartTimeLabel)
+        profileWidgetLayout.addWidget(self.profileStartTimeCB)
+        profileWidgetLayout.addWidget(profileVariablesLabel)
+        self.profileVariablesList.setMinimumHeight(90)
+        self.profileVariablesList.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        profileWidgetLayout.addWidget(self.profileVariablesList)
+        profileWidgetLayout.addWidget(self.profileSplitCB)
+
+        vmWidget = QWidget()
+        vmWidgetlayout = QVBoxLayout(vmWidget)
+        vmStartTimeLabel = QLabel('Start Time', vmWidget)
+        vmEndTimeLabel = QLabel('End Time', vmWidget)
+        self.vmStartTimeCB = QComboBox(vmWidget)
+        self.vmEndTimeCB = QComboBox(vmWidget)
+        vmDepthLabel = QLabel('Depth', vmWidget)
+        self.vmDepthCB = QComboBox(vmWidget)
+
+        # split long ranges into parallel requests of this many timestamps
+        vmChunkLabel = QLabel('Timestamps per Request', vmWidget)
+        self.vmChunkSB = QSpinBox(vmWidget)
+        self.vmChunkSB.setRange(0, 10000)
+        self.vmChunkSB.setSpecialValueText('All')
+        self.vmChunkSB.setValue(0)
+
+        vmWidgetlayout.addWidget(vmStartTimeLabel)
+        vmWidgetlayout.addWidget(self.vmStartTimeCB)
+        vmWidgetlayout.addWidget(vmEndTimeLabel)
+        vmWidgetlayout.addWidget(self.vmEndTimeCB)
+        vmWidgetlayout.addWidget(vmDepthLabel)
+        vmWidgetlayout.addWidget(self.vmDepthCB)
+        vmWidgetlayout.addWidget(vmChunkLabel)
+        vmWidgetlayout.addWidget(self.vmChunkSB)
+        vmWidgetlayout.addStretch()
+
+        areaWidget = QWidget()
+        areaWidgetLayout = QVBoxLayout(areaWidget)
+        arrowsLabel = QLabel('Arrows', areaWidget)
+        addContLabel = QLabel('Additional Contours', areaWidget)
+        areaStartTimeLabel = QLabel('Start Time', profileWidget)
+        self.areaStartTimeCB = QComboBox(areaWidget)
+        self.arrowsCB = QComboBox(areaWidget)
+        self.arrowsCB.addItems(['None', 'Water Velocity'])
+        self.addContourCB = QComboBox(areaWidget)
+        # long variable names shouldn't widen the page past the tab
+        for combo in (self.arrowsCB, self.addContourCB):
+            combo.setSizeAdjustPolicy(QComboBox.AdjustToMinimumContentsLengthWithIcon)
+            combo.setMinimumContentsLength(12)
+
+        # optionally fetch the area as a grid of smaller tiles
+        areaTileFrame = QWidget(areaWidget)
+        areaTileLayout = QHBoxLayout(areaTileFrame)
+        areaTileLayout.setContentsMargins(0,0,0,0)
+        self.areaTilesSB = QSpinBox(areaTileFrame)
+        self.areaTilesSB.setRange(1, 8)
+        self.areaTilesSB.setValue(1)
+        self.areaTilesSB.setToolTip('Fetch CSV and NumPy areas in pieces; PNG areas are always fetched whole')
+        self.areaOverlapSB = QSpinBox(areaTileFrame)
+        self.areaOverlapSB.setRange(0, 50)
+        self.areaOverlapSB.setSuffix(' %')
+        self.areaOverlapSB.setValue(10)
+        areaTileLayout.addWidget(self.areaTilesSB)
+        areaTileLayout.addWidget(self.areaOverlapSB)
+        areaTileLabel = QLabel('Tiles per Side, Overlap', areaWidget)
+
+        areaWidgetLayout.addWidget(areaStartTimeLabel)
+        areaWidgetLayout.addWidget(self.areaStartTimeCB)
+        areaWidgetLayout.addWidget(arrowsLabel)
+        areaWidgetLayout.addWidget(self.arrowsCB)
+        areaWidgetLayout.addWidget(addContLabel)
+        areaWidgetLayout.addWidget(self.addContourCB)
+        areaWidgetLayout.addWidget(areaTileLabel)
+        areaWidgetLayout.addWidget(areaTileFrame)
+        areaWidgetLayout.addStretch()
+
+        plotOptionsHeader = QLabel('API Options', optionsLFrame)
+        plotOptionsHeader.setFixedWidth(270)
+        plotOptionsHeader.setFixedHeight(20)
+        plotOptionsHeader.setStyleSheet('background-color: #008cba; color : #ffffff;')
+        plotOptionsHeader.setAlignment(Qt.AlignCenter)
+
+        self.plotOptions = QTabWidget(optionsLFrame)
+        self.plotOptions.setFixedSize(270,320)
+        self.plotOptions.addTab(self.scrollPage(profileWidget), 'Profile')
+        self.plotOptions.addTab(self.scrollPage(vmWidget), 'Virtual Mooring')
+        self.plotOptions.addTab(self.scrollPage(areaWidget), 'Area')
+        self.plotOptions.currentChanged.connect(lambda: self.optChanged())
+
+        buttonFrame = QFrame(bottomFrame)
+        buttonFrameLayout = QHBoxLayout(buttonFrame)
+
+        outputLabel = QLabel('Output Format', buttonFrame)
+
+        self.outputCB = QComboBox(buttonFrame)
+        self.outputCB.addItems(['CSV', 'PNG', 'NumPy'])
+        self.outputCB.setFixedWidth(60)
+
+        workersLabel = QLabel('Max Concurrent', buttonFrame)
+
+        self.workersSB = QSpinBox(buttonFrame)
+        self.workersSB.setRange(1, 16)
+        self.workersSB.setValue(8)
+        self.workersSB.setFixedWidth(50)
+        self.workersSB.setToolTip('Requests in flight adapt to the server, up to this many')
+
+        self.outputConsole = QPlainTextEdit(bottomFrame)
+        self.outputConsole.setReadOnly(True)
+        self.outputConsole.setMaximumBlockCount(1000)
+
+        self.submitButton = QPushButton(buttonFrame)
+        self.submitButton.setText('Submit')
+        self.submitButton.setStyleSheet('background-color: #008cba; color : #ffffff;')
+        self.submitButton.clicked.connect(lambda: self.makeAPICall())
+
+        progressFrame = QFrame(bottomFrame)
+        progressFrameLayout = QHBoxLayout(progressFrame)
+        progressFrameLayout.setContentsMargins(0,0,0,0)
+
+        self.progressBar = QProgressBar(progressFrame)
+        self.progressBar.setRange(0, 1)
+        self.progressBar.setValue(0)
+
+        self.cancelButton = QPushButton(progressFrame)
+        self.cancelButton.setText('Cancel')
+        self.cancelButton.setStyleSheet('background-color: #008cba; color : #ffffff;')
+        self.cancelButton.setEnabled(False)
+        self.cancelButton.clicked.connect(lambda: self.cancelTask())
+
+        self.logLevelCB = QComboBox(progressFrame)
+        for name in ('Debug', 'Info', 'Warning', 'Error'):
+            self.logLevelCB.addItem(name, logging.getLevelName(name.upper()))
+        self.logLevelCB.setCurrentText('Info')
+        self.logLevelCB.setToolTip('Least severe messages shown in the console')
+        self.logLevelCB.currentIndexChanged.connect(self.logLevelChanged)
+
+        self.logFileCB = QCheckBox(progressFrame)
+        self.logFileCB.setText('Log to file')
+        self.logFileCB.setToolTip('Keep every message in ' + logFileName)
+        self.logFileCB.toggled.connect(self.logFileToggled)
+
+        progressFrameLayout.addWidget(self.progressBar)
+        progressFrameLayout.addWidget(self.cancelButton)
+        progressFrameLayout.addWidget(self.logLevelCB)
+        progressFrameLayout.addWidget(self.logFileCB)
+
+        buttonFrameLayout.addWidget(outputLabel)
+        buttonFrameLayout.addWidget(self.outputCB)
+        buttonFrameLayout.addWidget(workersLabel)
+        buttonFrameLayout.addWidget(self.workersSB)
+        buttonFrameLayout.addWidget(self.submitButton)
+
+        optionsLLayout.addWidget(dataPanel)
+        optionsLLayout.addWidget(plotOptionsHeader)
+        optionsLLayout.addWidget(self.plotOptions)
+        optionsLLayout.addStretch()
+        optionsRLayout.addWidget(locationPanel)
+        optionsRLayout.addStretch()
+        bottomLayout.addWidget(self.outputConsole)
+        bottomLayout.addWidget(progressFrame)
+        bottomLayout.addWidget(buttonFrame)
+
+        self.datasetChanged()
+    
+    def scrollPage(self, page):
+        # tab pages scroll rather than squash their controls when they
+        # need more room than the tab has
+        scroll = QScrollArea()
+        scroll.setWidget(page)
+        scroll.setWidgetResizable(True)
+        scroll.setFrameShape(QFrame.NoFrame)
+        scroll.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        return scroll
+
+    def addRows(self):
+        # adds an additional row to the coordinates table
+        self.latlonModel.setRowCount(self.latlonModel.rowCount() + 1)
+
+    def removeRows(self):
+        # removes the last row from the coordinates table
+        if self.latlonModel.rowCount() > 1:
+            self.latlonModel.setRowCount(self.latlonModel.rowCount() - 1)
+
+    def importPoints(self):
+        # load a station list or polygon from a CSV/text or GeoJSON file
+        fileName, _ = QFileDialog.getOpenFileName(self, 'Import Coordinates', '',
+                                                  'Coordinates (*.csv *.txt *.geojson *.json);;All Files (*)')
+        if not fileName:
+            return
+        try:
+            with open(fileName) as f:
+                text = f.read()
+            if fileName.lower().endswith(('.geojson', '.json')):
+                count = self.latlonModel.loadGeoJSON(text)
+            else:
+                self.latlonModel.setRowCount(0)
+                count = self.latlonModel.loadText(text)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            self.log(f'Could not import {fileName}: {e}', logging.ERROR)
+            return
+        self.log(f'Imported {count} points from {fileName}')
+
+    def optChanged(self):
+        # change the number of rows in the coordinates table based on which tab is selected
+        if self.plotOptions.currentIndex() == 0 or self.plotOptions.currentIndex() == 1:
+            self.latlonModel.setRowCount(1)
+        elif self.plotOptions.currentIndex() == 2:
+            self.latlonModel.setRowCount(4)
+
+    def datasetChanged(self):
+
+        dataset = self.datasetDict[self.datasetCB.currentText()]
+        self.quantum = quantums[dataset]
+        self.variableDict = dict(variables[dataset])
+
+        # refill the variable list without a variableChanged per item
+        self.variableCB.blockSignals(True)
+        self.variableCB.clear()
+        self.variableCB.addItems(self.variableDict.keys())
+        self.variableCB.blockSignals(False)
+
+        self.addContourCB.clear()
+        self.addContourCB.addItem('None')
+        self.addContourCB.addItems(self.variableDict.keys())
+        self.profileVariablesList.clear()
+        for name in self.variableDict:
+            item = QListWidgetItem(name, self.profileVariablesList)
+            item.setCheckState(Qt.Unchecked)
+
+        self.loadMetadata()
+
+    def variableChanged(self):
+        # the time and depth lists belong to the selected variable
+        if self.variableCB.currentText() in self.variableDict:
+            self.loadMetadata()
+
+    def loadMetadata(self):
+        query = {'dataset' : self.datasetDict[self.datasetCB.currentText()],
+                    'variable' : self.variableDict[self.variableCB.currentText()]}
+
+        self.metadataGeneration += 1
+        generation = self.metadataGeneration
+
+        # answer straight from the local cache when possible, refreshing
+        # stale entries in the background without locking the window
+        cached = apiCalls.cachedMetadata(query)
+        if cached is not None:
+            timestamps, depths, fresh = cached
+            self.metadataPending = False
+            self.updateBusy()
+            self.showMetadata(timestamps, depths)
+            if not fresh:
+                worker = Worker(apiCalls.metadata, query, False)
+                worker.signals.result.connect(lambda result: self.metadataRevalidated(generation, result))
+                self.startWorker(worker)
+            return
+
+        # otherwise fetch timestamps and depths off the GUI thread
+        worker = Worker(apiCalls.metadata, query)
+        worker.signals.result.connect(lambda result: self.metadataLoaded(generation, result))
+        worker.signals.error.connect(lambda error: self.metadataFailed(generation, error))
+        self.metadataPending = True
+        self.updateBusy()
+        self.startWorker(worker)
+
+    def metadataLoaded(self, generation, result):
+        # ignore results for a dataset the user has since moved away from
+        if generation != self.metadataGeneration:
+            return
+        self.metadataPending = False
+        self.updateBusy()
+
+        timestamps, depths = result
+        if timestamps is None or depths is None:
+            self.clearMetadata()
+            self.log('Could not load dataset metadata.', logging.ERROR)
+            return
+
+        self.showMetadata(timestamps, depths)
+
+    def metadataRevalidated(self, generation, result):
+        # only redraw the time and depth lists if the server's copy changed
+        timestamps, depths = result
+        if generation != self.metadataGeneration or timestamps is None or depths is None:
+            return
+        if timestamps != self.timestampDict or depths != self.depthDict:
+            self.showMetadata(timestamps, depths)
+
+    def showMetadata(self, timestamps, depths):
+        self.timestampDict = timestamps
+        self.depthDict = depths
+        self.metadataReady = True
+        self.updateBusy()
+
+        self.profileStartTimeCB.clear()
+        self.profileStartTimeCB.addItems(self.timestampDict.keys())
+        self.profileStartTimeCB.setCurrentIndex(0)
+        self.vmStartTimeCB.clear()
+        self.vmStartTimeCB.addItems(self.timestampDict.keys())
+        self.vmStartTimeCB.setCurrentIndex(0)
+        self.vmEndTimeCB.clear()
+        self.vmEndTimeCB.addItems(self.timestampDict.keys())
+        self.vmEndTimeCB.setCurrentIndex(len(self.timestampDict.keys())-1)
+        self.vmDepthCB.clear()
+        self.vmDepthCB.addItems(self.depthDict.keys())
+        self.areaStartTimeCB.clear()
+        self.areaStartTimeCB.addItems(self.timestampDict.keys())
+        self.areaStartTimeCB.setCurrentIndex(0)
+
+    def metadataFailed(self, generation, error):
+        if generation != self.metadataGeneration:
+            return
+        self.metadataPending = False
+        self.clearMetadata()
+        self.log('Could not load dataset metadata: ' + error, logging.ERROR)
+
+    def clearMetadata(self):
+        # empty the time and depth lists rather than leave the previous
+        # dataset's in place, and lock Submit until new ones arrive
+        self.timestampDict = {}
+        self.depthDict = {}
+        self.metadataReady = False
+        for combo in (self.profileStartTimeCB, self.vmStartTimeCB, self.vmEndTimeCB,
+                      self.vmDepthCB, self.areaStartTimeCB):
+            combo.clear()
+        self.updateBusy()
+
+    def prefetchMetadata(self):
+        # one background worker at a time, and none while a batch is running
+        if self.prefetchWorker is not None or self.batchWorker is not None:
+            return
+
+        # the selected dataset first, as it is the likeliest to be needed
+        current = self.datasetDict[self.datasetCB.currentText()]
+        order = [current] + [d for d in self.datasetDict.values() if d != current]
+        pairs = [(dataset, variable) for dataset in order for variable in variables[dataset].values()]
+
+        self.prefetchWorker = Worker(apiCalls.prefetchMetadata, pairs)
+        self.prefetchWorker.kwargs['cancelEvent'] = self.prefetchWorker.cancelEvent
+        self.prefetchWorker.signals.result.connect(self.prefetchFinished)
+        self.prefetchWorker.signals.finished.connect(lambda: setattr(self, 'prefetchWorker', None))
+        self.startWorker(self.prefetchWorker)
+
+    def prefetchFinished(self, failed):
+        # a selection whose metadata could not be loaded earlier gets
+        # another try now the cache is warm
+        if not self.metadataReady and not self.metadataPending:
+            self.loadMetadata()
+        if failed:
+            self.log(f'Could not load metadata for {len(failed)} dataset variables in the background.',
+                     logging.WARNING)
+
+    def log(self, message, level=logging.INFO):
+        # safe to call from any thread; shown on the next flushLog
+        logger.log(level, message)
+        self.logBuffer.append(message, level)
+
+    def flushLog(self):
+        # append everything logged since the last flush at or above the
+        # chosen level as a single block of text
+        records, self.logCount = self.logBuffer.since(self.logCount, self.logLevelCB.currentData())
+        if records:
+            records = records[-self.outputConsole.maximumBlockCount():]
+            self.outputConsole.appendPlainText('\n'.join(message for _, _, message in records))
+
+    def logLevelChanged(self):
+        # redraw the console from the buffer with the new filter
+        self.outputConsole.clear()
+        self.logCount = 0
+        self.flushLog()
+
+    def logFileToggled(self, checked):
+        if checked:
+            os.makedirs(os.path.dirname(logFileName), exist_ok=True)
+            setLogFile(logFileName)
+            self.log('Logging to ' + logFileName)
+        else:
+            setLogFile(None)
+
+    def closeEvent(self, event):
+        # don't keep the process alive for metadata or files nobody will
+        # see; requests already in flight are allowed to finish
+        if self.prefetchWorker is not None:
+            self.prefetchWorker.cancelEvent.set()
+        if self.batchWorker is not None:
+            self.batchWorker.cancelEvent.set()
+        super(Onav_lite, self).closeEvent(event)
+
+    def startWorker(self, worker):
+        # hold a reference until the worker is done so its signals stay alive
+        self.workers.add(worker)
+        worker.signals.finished.connect(lambda: self.workers.discard(worker))
+        self.threadPool.start(worker)
+
+    def updateBusy(self):
+        # lock the submit button while a background task is running
+        busy = self.metadataPending or self.batchWorker is not None
+        self.submitButton.setEnabled(not busy and self.metadataReady)
+        self.cancelButton.setEnabled(busy)
+        if self.batchWorker is None:
+            self.progressBar.setRange(0, 0 if self.metadataPending else 1)
+            self.progressBar.setValue(0)
+
+    def cancelTask(self):
+        if self.batchWorker is not None:
+            self.log('Cancelling...')
+            self.batchWorker.cancelEvent.set()
+            self.cancelButton.setEnabled(False)
+        else:
+            # forget the pending metadata request
+            self.metadataGeneration += 1
+            self.metadataPending = False
+            self.clearMetadata()
+            self.log('Cancelled loading dataset metadata.')
+
+    def batchProgress(self, done, total):
+        self.progressBar.setRange(0, total)
+        self.progressBar.setValue(done)
+
+    def batchFinished(self):
+        self.batchWorker = None
+        self.updateBusy()
+
+    def getLatLon(self):
+
+        points, badRows = self.latlonModel.points()
+
+        # refuse to submit anything while some rows are bad, and say which
+        if len(badRows):
+            rows = ', '.join(str(r + 1) for r in badRows[:20])
+            more = f' and {len(badRows) - 20} more' if len(badRows) > 20 else ''
+            self.log(f'Coordinate format error in rows {rows}{more}.', logging.ERROR)
+            return []
+
+        return points
+
+    def makeAPICall(self):
+        if not self.metadataReady:
+            self.log('Dataset metadata has not loaded yet.', logging.ERROR)
+            return
+
+        self.log('Making query...')
+        points = self.getLatLon()
+        jobs = []
+
+        dataset = self.datasetDict[self.datasetCB.currentText()]
+        variable = self.variableDict[self.variableCB.currentText()]
+
+        if self.plotOptions.currentIndex() == 0:
+            profileVariables = [variable]
+            for i in range(self.profileVariablesList.count()):
+                item = self.profileVariablesList.item(i)
+                if item.checkState() == Qt.Checked and self.variableDict[item.text()] not in profileVariables:
+                    profileVariables.append(self.variableDict[item.text()])
+
+            for p in points:
+                jobs.append(profileJob(dataset, profileVariables, self.quantum,
+                                        self.timestampDict[self.profileStartTimeCB.currentText()], p))
+
+        elif self.plotOptions.currentIndex() == 1:
+            for p in points:
+                jobs.append(mooringJob(dataset, variable, self.quantum,
+                                        self.timestampDict[self.vmStartTimeCB.currentText()],
+                                        self.timestampDict[self.vmEndTimeCB.currentText()], p))
+
+        elif self.plotOptions.currentIndex() == 2:
+
+            if self.arrowsCB.currentText() == 'None':
+                arrowVar = 'none'
+            else:
+                arrowVar = self.variableDict[self.arrowsCB.currentText()]
+
+            if self.addContourCB.currentText() == 'None':
+                contoutVar = 'none'
+            else:
+                contoutVar = self.variableDict[self.addContourCB.currentText()]
+
+            if len(points) >= 3:
+                jobs.append(areaJob(dataset, variable, self.quantum,
+                                    self.timestampDict[self.areaStartTimeCB.currentText()],
+                                    points, arrowVar, contoutVar))
+
+        if not jobs:
+            # bad rows were reported by getLatLon; otherwise nothing to send
+            if points:
+                self.log('An area needs at least 3 points.', logging.ERROR)
+            elif not len(self.latlonModel.badRows()):
+                self.log('Enter at least one complete latitude and longitude.', logging.ERROR)
+            return
+
+        self.apiCalls.setMaxWorkers(self.workersSB.value())
+        self.apiCalls.timeChunkSize = self.vmChunkSB.value()
+        self.apiCalls.tileGrid = (self.areaTilesSB.value(), self.areaTilesSB.value())
+        self.apiCalls.tileOverlap = self.areaOverlapSB.value() / 100
+        self.apiCalls.snapToGrid = self.snapToGridCB.isChecked()
+        self.apiCalls.splitVariables = self.profileSplitCB.isChecked()
+
+        if self.outputCB.currentText() == 'NumPy':
+            # one merged array for the whole submission
+            storeName = '_'.join([self.plotOptions.tabText(self.plotOptions.currentIndex()).replace(' ', '_'),
+                                  dataset, variable, time.strftime('%Y%m%d%H%M%S')])
+            self.batchWorker = Worker(self.apiCalls.columnarBatch, jobs, storeName)
+        else:
+            self.batchWorker = Worker(self.apiCalls.batch, jobs, self.outputCB.currentText())
+        self.batchWorker.kwargs.update(progress=self.batchWorker.signals.progress.emit,
+                                        cancelEvent=self.batchWorker.cancelEvent)
+        self.batchWorker.signals.progress.connect(self.batchProgress)
+        self.batchWorker.signals.error.connect(lambda e: self.log(e, logging.ERROR))
+        self.batchWorker.signals.finished.connect(self.batchFinished)
+        self.updateBusy()
+        self.progressBar.setRange(0, max(len(jobs), 1))
+        self.progressBar.setValue(0)
+        self.startWorker(self.batchWorker)
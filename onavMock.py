@@ -0,0 +1,310 @@
+import argparse
+import calendar
+import json
+import math
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from onavAPI import quantums
+
+# Local stand-in for the Ocean Navigator API, for working and benchmarking
+# without network access. It answers
+#
+#   /api/v1.0/timestamps/?dataset=..&variable=..
+#   /api/v1.0/depth/?dataset=..&variable=..
+#   /api/v1.0/plot/?query=..[&save&format=csv]
+#
+# with made-up but well-formed data: CSVs have the columns the real server
+# sends for profile, timeseries and map queries, and PNGs are real images.
+# Every response is delayed by latency plus up to jitter seconds, plots by
+# renderTime more, and a fraction errorRate of them is answered 503 instead. With capacity set,
+# requests beyond that many at once slow every response in proportion, and
+# beyond twice that many are refused with 503, like a loaded server.
+# publishEvery adds a new newest time step every so many seconds, as if a
+# forecast cycle had come out. payloadSize sets the
+# approximate size in bytes of PNGs and of profile and timeseries CSVs; map
+# CSVs have one row per point of a 0.1 degree grid starting at the
+# polygon's south-west corner. Like the real server's, the grid follows
+# each polygon's own bounds, so overlapping tiles don't share points.
+#
+#   python onavMock.py --port 8080 --latency 0.2 --error-rate 0.05
+#   python ONavLite.py --url http://127.0.0.1:8080
+
+
+# timestamp ids are seconds since this date, as on the real server
+epoch = calendar.timegm((1950, 1, 1, 0, 0, 0))
+
+# two dimensional variables have no depth list
+surfaceVariables = {'sossheig', 'deepsoundchannel', 'deepsoundchannelbottom', 'depthexcess',
+                    'psubsurfacechannel'}
+
+depthLevels = [0.5, 1.5, 2.6, 3.8, 5.1, 6.4, 7.9, 9.6, 11.4, 13.5, 15.8, 18.5, 21.6, 25.2,
+               29.4, 34.4, 40.3, 47.4, 55.8, 65.8, 77.9, 92.3, 109.7, 130.7, 155.9, 186.1,
+               222.5, 266.0, 318.1, 380.2, 453.9, 541.1, 643.6, 763.3, 902.3, 1062.4,
+               1245.3, 1452.3, 1684.3, 1941.9, 2225.1, 2533.3, 2865.7, 3220.8, 3597.0,
+               3992.5, 4405.2, 4833.3, 5274.8]
+
+
+class MockNavigator(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0.0, jitter=0.0, payloadSize=20000, errorRate=0.0,
+                 timestampCount=240, host='127.0.0.1', capacity=0, publishEvery=0, renderTime=0.0):
+        super().__init__((host, port), MockHandler)
+        self.url = f'http://{host}:{self.server_address[1]}'
+        self.latency = latency
+        self.jitter = jitter
+        self.payloadSize = payloadSize
+        self.errorRate = errorRate
+        self.timestampCount = timestampCount
+        self.capacity = capacity
+        self.publishEvery = publishEvery
+        self.renderTime = renderTime
+        self.started = time.time()
+        self.active = 0
+        self.counts = {}
+        self.lock = threading.Lock()
+        self.pngs = {}
+        self.thread = None
+
+    def start(self):
+        # serve from a background thread; returns self for chaining
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def load(self, change):
+        with self.lock:
+            self.active += change
+            return self.active
+
+    def timestamps(self, dataset):
+        # the newest timestampCount steps of the dataset's quantum, ending
+        # at the start of the day the server started plus one step per
+        # publishEvery seconds since
+        step = 86400 if quantums.get(dataset) == 'day' else 3600
+        last = int(self.started) // 86400 * 86400 - epoch
+        if self.publishEvery:
+            last += step * int((time.time() - self.started) / self.publishEvery)
+        return [last - step * k for k in range(self.timestampCount - 1, -1, -1)]
+
+    def timeText(self, timeId):
+        return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(epoch + timeId))
+
+    def timestampsBody(self, dataset, variable):
+        return json.dumps([{'id' : t, 'value' : self.timeText(t) + '+00:00'}
+                           for t in self.timestamps(dataset)]).encode('utf-8')
+
+    def depthBody(self, dataset, variable):
+        if variable in surfaceVariables:
+            return b'[]'
+        levels = [{'id' : k, 'value' : f'{d:g} m'} for k, d in enumerate(depthLevels)]
+        levels.append({'id' : 'bottom', 'value' : 'Bottom'})
+        return json.dumps(levels).encode('utf-8')
+
+    def value(self, *seeds):
+        # smooth, repeatable fake data
+        return round(10 + 5 * math.sin(sum(seeds) * 0.37), 4)
+
+    def csvBody(self, query):
+        lines = [f"// Dataset: {query.get('dataset')}", '// Mock data']
+
+        if query.get('type') == 'profile':
+            names = query['variable'] if isinstance(query['variable'], list) else [query['variable']]
+            lat, lon = query['station'][0]
+            lines.append('Latitude,Longitude,Depth,' + ','.join(names))
+            k = size = 0
+            while k < 2 or size < self.payloadSize:
+                depth = depthLevels[k] if k < len(depthLevels) else depthLevels[-1] + k
+                lines.append(f'{lat},{lon},{depth:g},' +
+                             ','.join(str(self.value(lat, lon, depth, v)) for v in range(len(names))))
+                size += len(lines[-1]) + 1
+                k += 1
+
+        elif query.get('type') == 'timeseries':
+            lat, lon = query['station'][0]
+            lines.append(f"Latitude,Longitude,Time,Depth,{query['variable']}")
+            times = [t for t in self.timestamps(query['dataset']) if query['starttime'] <= t <= query['endtime']]
+            # deeper profiles for bigger payloads, at least one row per time
+            rowSize = len(f'{lat},{lon},2026-01-01 00:00:00,0.5,10.0000') + 1
+            levels = max(1, min(len(depthLevels), self.payloadSize // (rowSize * max(1, len(times)))))
+            for t in times:
+                for depth in depthLevels[:levels]:
+                    lines.append(f"{lat},{lon},{self.timeText(t).replace('T', ' ')},{depth:g},"
+                                 f'{self.value(lat, lon, t / 3600, depth)}')
+
+        elif query.get('type') == 'map':
+            polygon = query['area'][0]['polygons'][0]
+            lats = [p[0] for p in polygon]
+            lons = [p[1] for p in polygon]
+            lines.append(f"Latitude,Longitude,{query['variable']}")
+            for i in range(math.floor((max(lats) - min(lats)) * 10 + 1e-9) + 1):
+                lat = round(min(lats) + i / 10, 6)
+                for j in range(math.floor((max(lons) - min(lons)) * 10 + 1e-9) + 1):
+                    lon = round(min(lons) + j / 10, 6)
+                    lines.append(f'{lat:g},{lon:g},{self.value(lat * 10, lon * 10)}')
+
+        else:
+            raise ValueError(f"Unknown plot type {query.get('type')}")
+
+        return ('\n'.join(lines) + '\n').encode('utf-8')
+
+    def pngBody(self):
+        # an RGB image of noise, which deflate can't shrink, sized to payloadSize
+        with self.lock:
+            if self.payloadSize not in self.pngs:
+                width = 256
+                height = max(1, self.payloadSize // (width * 3 + 1))
+                rng = random.Random(height)
+                raw = b''.join(b'\x00' + rng.randbytes(width * 3) for _ in range(height))
+
+                def chunk(kind, data):
+                    return (struct.pack('>I', len(data)) + kind + data +
+                            struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+                self.pngs[self.payloadSize] = (b'\x89PNG\r\n\x1a\n' +
+                                               chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) +
+                                               chunk(b'IDAT', zlib.compress(raw, 1)) +
+                                               chunk(b'IEND', b''))
+            return self.pngs[self.payloadSize]
+
+class MockHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        # headers and body go out in separate writes; don't let Nagle's
+        # algorithm hold the body back for the client's delayed ACK
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, body=b'', contentType='text/plain', headers=()):
+        self.send_response(status)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        params = {k : v[0] for k, v in parse_qs(url.query, keep_blank_values=True).items()}
+        endpoint = url.path.rstrip('/').rsplit('/', 1)[-1]
+        server.count(endpoint)
+
+        active = server.load(1)
+        try:
+            delay = server.latency + random.uniform(0, server.jitter)
+            if endpoint == 'plot':
+                delay += server.renderTime
+            if server.capacity and active > server.capacity:
+                if active > 2 * server.capacity:
+                    server.count('overloaded')
+                    self.send(503, b'Mock server overloaded')
+                    return
+                delay *= active / server.capacity
+            time.sleep(delay)
+
+            if random.random() < server.errorRate:
+                server.count('errors')
+                self.send(503, b'Mock error', headers=[('Retry-After', '0')])
+                return
+
+            self.respond(endpoint, params)
+        finally:
+            server.load(-1)
+
+    def respond(self, endpoint, params):
+        server = self.server
+        try:
+            if endpoint == 'timestamps':
+                self.send(200, server.timestampsBody(params['dataset'], params['variable']), 'application/json')
+            elif endpoint == 'depth':
+                self.send(200, server.depthBody(params['dataset'], params['variable']), 'application/json')
+            elif endpoint == 'plot':
+                query = json.loads(params['query'])
+                if params.get('format') == 'csv':
+                    body, contentType = server.csvBody(query), 'text/csv'
+                else:
+                    body, contentType = server.pngBody(), 'image/png'
+                self.sendRange(body, contentType)
+            else:
+                self.send(404, b'Not found')
+        except (KeyError, TypeError, ValueError) as e:
+            self.send(400, str(e).encode('utf-8'))
+
+    def sendRange(self, body, contentType):
+        # honour 'Range: bytes=N-' so interrupted downloads can resume,
+        # unless an If-Range names a different version of the body
+        etag = f'"{zlib.crc32(body):08x}"'
+        offset = self.headers.get('Range', '')
+        if self.headers.get('If-Range', etag) != etag:
+            offset = ''
+        if offset.startswith('bytes=') and offset.endswith('-') and offset[6:-1].isdigit():
+            offset = int(offset[6:-1])
+            if offset >= len(body):
+                self.send(416, headers=[('Content-Range', f'bytes */{len(body)}')])
+                return
+            self.send(206, body[offset:], contentType,
+                      [('Content-Range', f'bytes {offset}-{len(body) - 1}/{len(body)}'), ('ETag', etag)])
+        else:
+            self.send(200, body, contentType, [('ETag', etag)])
+
+def main(argv=None):
+    argv = sys.argv if argv is None else argv
+
+    parser = argparse.ArgumentParser(description='Local stand-in for the Ocean Navigator API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='up to this many more seconds, at random')
+    parser.add_argument('--payload-size', type=int, default=20000,
+                        help='approximate size in bytes of PNG and profile/timeseries CSV responses')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='fraction of requests answered with HTTP 503')
+    parser.add_argument('--timestamps', type=int, default=240,
+                        help='number of timestamps per dataset')
+    parser.add_argument('--capacity', type=int, default=0,
+                        help='concurrent requests served at full speed (default unlimited)')
+    parser.add_argument('--publish-every', type=float, default=0,
+                        help='seconds between new time steps (default never)')
+    parser.add_argument('--render-time', type=float, default=0.0,
+                        help='seconds added to plot responses only')
+    args = parser.parse_args(argv[1:])
+
+    server = MockNavigator(args.port, args.latency, args.jitter, args.payload_size, args.error_rate,
+                           args.timestamps, args.host, args.capacity, args.publish_every, args.render_time)
+    print(f'Serving a mock navigator API on {server.url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,38 @@
+import os
+import sys
+
+import pytest
+
+# the modules live at the top of the repository rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from onavAPI import (LogBuffer, MetadataCache, RequestScheduler, ResultCache,  # noqa: E402
+                     Telemetry, apiCalls)
+from onavMock import MockNavigator  # noqa: E402
+
+
+@pytest.fixture
+def home(tmp_path, monkeypatch):
+    # keep caches, logs and results out of the real home directory, and
+    # give every test its own metadata cache, scheduler and telemetry
+    monkeypatch.setenv('HOME', str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(apiCalls, 'metadataCache', MetadataCache(str(tmp_path / 'metadata.json.gz')))
+    monkeypatch.setattr(apiCalls, 'scheduler', RequestScheduler())
+    monkeypatch.setattr(apiCalls, 'telemetry', Telemetry())
+    monkeypatch.setattr(apiCalls, 'printLevel', 100)
+    return tmp_path
+
+@pytest.fixture
+def navigator(home, monkeypatch):
+    # a mock server on a free port with apiCalls pointed at it
+    server = MockNavigator(payloadSize=1).start()
+    monkeypatch.setattr(apiCalls, 'baseUrl', server.url)
+    yield server
+    server.stop()
+
+@pytest.fixture
+def calls(navigator, home):
+    calls = apiCalls(LogBuffer(), 4, ResultCache(str(home / 'results')))
+    calls.backoff = 0
+    return calls
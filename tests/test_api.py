@@ -0,0 +1,196 @@
+import os
+import threading
+import time
+
+from onavAPI import (MetadataCache, RequestScheduler, ResultCache, SyncManifest, apiCalls,
+                     clipPolygon, profileJob)
+
+
+def test_clipPolygon_square():
+    square = [[0, 0], [0, 10], [10, 10], [10, 0]]
+    clipped = clipPolygon(square, 2, 5, -5, 4)
+    assert sorted(map(tuple, clipped)) == [(2, 0), (2, 4), (5, 0), (5, 4)]
+
+def test_clipPolygon_triangle_edge():
+    # the hypotenuse crosses the box, adding a vertex on each side it cuts
+    triangle = [[0, 0], [10, 0], [0, 10]]
+    clipped = clipPolygon(triangle, 0, 5, 0, 10)
+    assert sorted(map(tuple, clipped)) == [(0, 0), (0, 10), (5, 0), (5, 5)]
+
+def test_clipPolygon_outside():
+    assert clipPolygon([[0, 0], [0, 1], [1, 1]], 5, 6, 5, 6) == []
+
+
+def test_uniqueJobs(home):
+    calls = apiCalls(None, 1, ResultCache(str(home / 'results')))
+    a, name = profileJob('giops_day', 'votemper', 'day', 100, [47.5, -52.7])
+    b, _ = profileJob('giops_day', 'votemper', 'day', 200, [47.5, -52.7])
+    unique, repeats = calls.uniqueJobs([(a, name), (dict(a), name), (b, name), (a, name)])
+    assert unique == [(a, name), (b, name + '_1')]
+    assert repeats == {name : 2}
+
+
+def test_metadataCache_ttl(tmp_path):
+    path = str(tmp_path / 'metadata.json.gz')
+    cache = MetadataCache(path)
+    assert cache.lookup('s', 'timestamps', 'd', 'v') == (None, False)
+
+    cache.store('s', 'timestamps', 'd', 'v', {'2026-01-01 00:00:00' : 1})
+    assert cache.lookup('s', 'timestamps', 'd', 'v') == ({'2026-01-01 00:00:00' : 1}, True)
+
+    # past its TTL an entry is still returned, but flagged stale
+    cache.entries[cache.key('s', 'timestamps', 'd', 'v')]['fetched'] -= MetadataCache.ttl['timestamps'] + 1
+    assert cache.lookup('s', 'timestamps', 'd', 'v') == ({'2026-01-01 00:00:00' : 1}, False)
+
+    # depth lists are kept much longer than timestamps
+    cache.store('s', 'depth', 'd', 'v', [1, 2])
+    cache.entries[cache.key('s', 'depth', 'd', 'v')]['fetched'] -= MetadataCache.ttl['timestamps'] + 1
+    assert cache.lookup('s', 'depth', 'd', 'v') == ([1, 2], True)
+
+    assert MetadataCache(path).lookup('s', 'depth', 'd', 'v') == ([1, 2], True)
+
+def test_metadataCache_eviction(tmp_path):
+    cache = MetadataCache(str(tmp_path / 'metadata.json.gz'), maxEntries=2)
+    cache.store('s', 'depth', 'd', 'a', 1)
+    cache.store('s', 'depth', 'd', 'b', 2)
+    cache.entries[cache.key('s', 'depth', 'd', 'a')]['used'] += 10
+    cache.store('s', 'depth', 'd', 'c', 3)
+    assert cache.lookup('s', 'depth', 'd', 'b') == (None, False)
+    assert cache.lookup('s', 'depth', 'd', 'a')[0] == 1
+    assert cache.lookup('s', 'depth', 'd', 'c')[0] == 3
+
+
+def writeFile(path, size):
+    with open(path, 'wb') as f:
+        f.write(os.urandom(size))
+    return str(path)
+
+def test_resultCache_hit_and_ttl(tmp_path):
+    cache = ResultCache(str(tmp_path / 'results'))
+    source = writeFile(tmp_path / 'a.csv', 100)
+    key = cache.key('url', {'a' : 1}, 'csv', 144)
+    assert key == cache.key('url', {'a' : 1}, 'csv', 144)
+    assert key != cache.key('url', {'a' : 1}, 'csv', 72)
+
+    assert not cache.fetch(key, 'csv', str(tmp_path / 'out.csv'))
+    cache.add(key, 'csv', source)
+    assert cache.fetch(key, 'csv', str(tmp_path / 'out.csv'), 'day')
+    with open(source, 'rb') as a, open(tmp_path / 'out.csv', 'rb') as b:
+        assert a.read() == b.read()
+
+    # hourly results go stale sooner than daily ones
+    entry = cache.entryPath(key, 'csv')
+    age = time.time() - 7 * 60 * 60
+    os.utime(entry, (time.time(), age))
+    assert cache.fetch(key, 'csv', str(tmp_path / 'out.csv'), 'day')
+    assert os.stat(entry).st_mtime == age
+    assert not cache.fetch(key, 'csv', str(tmp_path / 'out.csv'), 'hour')
+    assert (cache.hits, cache.misses) == (2, 2)
+
+def test_resultCache_lru_eviction(tmp_path):
+    cache = ResultCache(str(tmp_path / 'results'), maxBytes=2500)
+    keys = [cache.key('url', {'n' : n}, 'csv', 144) for n in range(3)]
+    cache.add(keys[0], 'csv', writeFile(tmp_path / '0.csv', 1000))
+    cache.add(keys[1], 'csv', writeFile(tmp_path / '1.csv', 1000))
+    for k, age in ((0, 200), (1, 100)):
+        os.utime(cache.entryPath(keys[k], 'csv'), (time.time() - age, time.time() - age))
+
+    # reading the older entry makes the other one least recently used
+    assert cache.fetch(keys[0], 'csv', str(tmp_path / 'out.csv'))
+    cache.add(keys[2], 'csv', writeFile(tmp_path / '2.csv', 1000))
+    assert sorted(os.listdir(cache.path)) == sorted([keys[0] + '.csv', keys[2] + '.csv'])
+
+def test_resultCache_hardlinks(tmp_path):
+    cache = ResultCache(str(tmp_path / 'results'), useHardlinks=True)
+    source = writeFile(tmp_path / 'a.csv', 100)
+    key = cache.key('url', {}, 'csv', 144)
+    cache.add(key, 'csv', source)
+    assert os.stat(cache.entryPath(key, 'csv')).st_ino == os.stat(source).st_ino
+    assert cache.fetch(key, 'csv', str(tmp_path / 'out.csv'))
+    assert os.stat(tmp_path / 'out.csv').st_ino == os.stat(source).st_ino
+
+
+def test_scheduler_additive_increase():
+    scheduler = RequestScheduler(maxConcurrency=8)
+    assert scheduler.limit == 4
+    for _ in range(50):
+        with scheduler.slot('plot') as slot:
+            slot['latency'] = 0.01
+    assert scheduler.limit == 8
+
+def test_scheduler_halves_once_per_round():
+    scheduler = RequestScheduler(maxConcurrency=8, minConcurrency=3)
+    scheduler.limit = 8.0
+    with scheduler.slot('plot') as slot:
+        slot['overloaded'] = True
+    assert scheduler.limit == 4
+    # a second failure from the same round trip doesn't count again
+    with scheduler.slot('plot') as slot:
+        slot['overloaded'] = True
+    assert scheduler.limit == 4
+
+    scheduler.lastDecrease -= 10
+    with scheduler.slot('plot') as slot:
+        slot['overloaded'] = True
+    assert scheduler.limit == 3
+
+def test_scheduler_latency_per_kind():
+    # slow plots are not compared with fast metadata lookups
+    scheduler = RequestScheduler(maxConcurrency=4)
+    for _ in range(5):
+        with scheduler.slot('metadata') as slot:
+            slot['latency'] = 0.01
+    for _ in range(5):
+        with scheduler.slot('plot') as slot:
+            slot['latency'] = 1.0
+    assert scheduler.limit == 4
+
+    # but a plot taking much longer than earlier plots is
+    for _ in range(10):
+        with scheduler.slot('plot') as slot:
+            slot['latency'] = 10.0
+    assert scheduler.limit == 2
+
+def test_scheduler_priority_order():
+    scheduler = RequestScheduler(maxConcurrency=1, adaptive=False)
+    order = []
+
+    def request(priority, name):
+        def run():
+            with scheduler.slot():
+                order.append(name)
+        scheduler.runAt(priority, run)
+
+    scheduler.acquire()
+    threads = []
+    for priority, name in ((RequestScheduler.BACKGROUND, 'background'), (RequestScheduler.BULK, 'bulk'),
+                           (RequestScheduler.INTERACTIVE, 'interactive')):
+        threads.append(threading.Thread(target=request, args=(priority, name)))
+        threads[-1].start()
+        while len(scheduler.waiting) < len(threads):
+            time.sleep(0.01)
+    scheduler.release()
+    for thread in threads:
+        thread.join(5)
+    assert order == ['interactive', 'bulk', 'background']
+
+
+def test_syncManifest(tmp_path):
+    path = str(tmp_path / 'manifest.json')
+    manifest = SyncManifest(path)
+    key = SyncManifest.key('giops_day', ['votemper', 'vosaline'], [47.5, -52.7], 100)
+    assert key == 'giops_day|votemper-vosaline|[47.5,-52.7]|100'
+    assert key not in manifest
+    assert manifest.start('profile', 'giops_day', 'votemper', 100) == 100
+    assert manifest.start('profile', 'giops_day', 'votemper', 200) == 100
+
+    manifest.add([key], 'a.csv')
+    manifest.save()
+    reloaded = SyncManifest(path)
+    assert key in reloaded
+    assert reloaded.entries[key]['file'] == 'a.csv'
+    assert reloaded.start('profile', 'giops_day', 'votemper', 300) == 100
+
+def test_syncManifest_unreadable(tmp_path):
+    (tmp_path / 'manifest.json').write_text('{not json')
+    assert SyncManifest(str(tmp_path / 'manifest.json')).entries == {}
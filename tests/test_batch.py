@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+from onavAPI import LogBuffer
+from onavBatch import loadStations, resolveTime, runJobFile, syncJobFile
+
+timestamps = {'2026-01-01 00:00:00 ' : 100, '2026-01-02 00:00:00 ' : 200}
+
+
+def writeJobFile(home, navigator, requests, **options):
+    spec = dict(output='results', url=navigator.url, workers=2, requests=requests, **options)
+    (home / 'jobs.json').write_text(json.dumps(spec))
+    return str(home / 'jobs.json')
+
+
+def test_resolveTime():
+    assert resolveTime(timestamps, 'first') == 100
+    assert resolveTime(timestamps, 'latest') == 200
+    assert resolveTime(timestamps, 150) == 150
+    assert resolveTime(timestamps, '2026-01-02T00:00:00+00:00') == 200
+    with pytest.raises(ValueError):
+        resolveTime(timestamps, '2026-01-03')
+
+def test_loadStations(tmp_path):
+    (tmp_path / 'stations.csv').write_text('lat,lon\n47.5,-52.7\n\n46,-50\n')
+    assert loadStations('stations.csv', str(tmp_path)) == [[47.5, -52.7], [46.0, -50.0]]
+    assert loadStations([['1', 2]], str(tmp_path)) == [[1.0, 2.0]]
+
+
+def test_runJobFile(navigator, home):
+    path = writeJobFile(home, navigator, [
+        {'type' : 'profile', 'dataset' : 'giops_day', 'variable' : 'Temperature',
+         'time' : 'latest', 'stations' : [[47.5, -52.7], [46.0, -50.0]]},
+        {'type' : 'map', 'dataset' : 'giops_day', 'variable' : 'votemper', 'time' : 'latest',
+         'polygon' : [[50, -60], [50, -59]]}])
+    summary = runJobFile(path, console=LogBuffer())
+    assert len(summary['succeeded']) == 2
+    # a polygon needs three points
+    assert len(summary['failed']) == 1
+    assert len(list((home / 'results').glob('Profile_*.csv'))) == 2
+
+def test_sync_fetches_only_new_steps(navigator, home, monkeypatch):
+    path = writeJobFile(home, navigator, [
+        {'type' : 'profile', 'dataset' : 'giops_day', 'variable' : 'votemper',
+         'time' : 'latest', 'stations' : [[47.5, -52.7]]}])
+
+    assert len(syncJobFile(path, console=LogBuffer())['succeeded']) == 1
+    assert syncJobFile(path, console=LogBuffer())['succeeded'] == []
+    assert navigator.counts['plot'] == 1
+
+    # a new forecast step is published
+    published = navigator.timestamps
+    monkeypatch.setattr(navigator, 'timestamps', lambda dataset: published(dataset) + [published(dataset)[-1] + 86400])
+    assert len(syncJobFile(path, console=LogBuffer())['succeeded']) == 1
+    assert navigator.counts['plot'] == 2
+
+    with open(home / 'results' / 'sync_manifest.json') as f:
+        assert len(json.load(f)['entries']) == 2
@@ -0,0 +1,152 @@
+import csv
+import json
+from urllib.parse import urlencode
+
+import pytest
+import requests
+
+from onavAPI import apiCalls, areaJob, mooringJob, profileJob
+
+polygon = [[50, -60], [50, -50], [45, -50], [45, -60]]
+
+
+def plotUrl(calls, query):
+    return calls.base_plot_url + urlencode({'query' : json.dumps(query)}) + '&save&format=csv'
+
+def readBytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def readRows(path):
+    # data rows of a result CSV, without the // comments and column names
+    with open(path, newline='') as f:
+        rows = [row for row in csv.reader(f) if row and not row[0].startswith('//')]
+    return rows[0], rows[1:]
+
+def latestTime(dataset='giops_day', variable='votemper'):
+    return list(apiCalls.timestamps({'dataset' : dataset, 'variable' : variable}).values())[-1]
+
+
+@pytest.fixture
+def mapResult(calls, home):
+    # a map CSV and its ETag, as fetched in one piece
+    query, _ = areaJob('giops_day', 'votemper', 'day', 100, polygon)
+    url = plotUrl(calls, query)
+    response = requests.get(url)
+    return url, response.content, response.headers['ETag']
+
+def test_resume_is_byte_identical(calls, home, mapResult):
+    url, body, etag = mapResult
+    target = str(home / 'map.csv')
+    with open(target + '.part', 'wb') as f:
+        f.write(body[:len(body) // 3])
+    with open(target + '.part.validator', 'w') as f:
+        f.write(etag)
+
+    assert calls.download(url, target)
+    assert readBytes(target) == body
+    record = apiCalls.telemetry.since(0)[-1]
+    assert (record['status'], record['bytes']) == (206, len(body) - len(body) // 3)
+    assert not (home / 'map.csv.part').exists()
+    assert not (home / 'map.csv.part.validator').exists()
+
+def test_resume_of_changed_result_starts_over(calls, home, mapResult):
+    url, body, _ = mapResult
+    target = str(home / 'map.csv')
+    with open(target + '.part', 'wb') as f:
+        f.write(b'x' * 100)
+    with open(target + '.part.validator', 'w') as f:
+        f.write('"00000000"')
+
+    assert calls.download(url, target)
+    assert readBytes(target) == body
+    assert apiCalls.telemetry.since(0)[-1]['status'] == 200
+
+def test_part_without_validator_is_discarded(calls, home, mapResult):
+    url, body, _ = mapResult
+    target = str(home / 'map.csv')
+    with open(target + '.part', 'wb') as f:
+        f.write(b'x' * 100)
+
+    assert calls.download(url, target)
+    assert readBytes(target) == body
+    record = apiCalls.telemetry.since(0)[-1]
+    assert (record['status'], record['bytes']) == (200, len(body))
+
+def test_download_gives_up_after_retries(calls, home, navigator, mapResult):
+    url, _, _ = mapResult
+    navigator.errorRate = 1.0
+    calls.retries = 1
+    assert not calls.download(url, str(home / 'map.csv'))
+    assert not (home / 'map.csv').exists()
+
+
+def test_tiles_merge_to_one_row_per_point(calls, home):
+    query, _ = areaJob('giops_day', 'votemper', 'day', 100, polygon)
+    assert calls.batch([(query, 'whole')], 'CSV')['succeeded'] == ['whole']
+
+    calls.tileGrid = (2, 2)
+    assert calls.batch([(query, 'tiled')], 'CSV')['succeeded'] == ['tiled']
+    header, rows = readRows(home / 'tiled.csv')
+    assert header == readRows(home / 'whole.csv')[0]
+
+    points = [(float(lat), float(lon)) for lat, lon, _ in rows]
+    assert len(points) == len(set(points))
+    assert all(45 <= lat <= 50 and -60 <= lon <= -50 for lat, lon in points)
+    # the tile boxes split the polygon into whole grid steps, so the tiled
+    # and untiled grids have the same number of points
+    assert len(points) == len(readRows(home / 'whole.csv')[1])
+    assert not list(home.glob('tiled.part*'))
+
+def test_time_chunks_stitch_to_whole(calls, home):
+    time = latestTime('giops_day', 'votemper')
+    query, _ = mooringJob('giops_day', 'votemper', 'day', time - 19 * 86400, time, [47.5, -52.7])
+    assert calls.batch([(query, 'whole')], 'CSV')['succeeded'] == ['whole']
+
+    calls.timeChunkSize = 6
+    chunks = calls.timeChunks(query)
+    assert [(c['starttime'], c['endtime']) for c in chunks] == \
+        [(time - 19 * 86400 + 6 * k * 86400, min(time, time - 14 * 86400 + 6 * k * 86400)) for k in range(4)]
+
+    assert calls.batch([(query, 'chunked')], 'CSV')['succeeded'] == ['chunked']
+    assert readBytes(home / 'chunked.csv') == readBytes(home / 'whole.csv')
+
+def test_time_chunks_keep_query_bounds(calls, home):
+    time = latestTime('giops_day', 'votemper')
+    query, _ = mooringJob('giops_day', 'votemper', 'day', time - 10 * 86400 - 5, time + 5, [47.5, -52.7])
+    calls.timeChunkSize = 4
+    chunks = calls.timeChunks(query)
+    assert chunks[0]['starttime'] == query['starttime']
+    assert chunks[-1]['endtime'] == query['endtime']
+
+def test_stitchCsv(calls, home):
+    (home / 'a.csv').write_text('// comment\nLatitude,Value\n1,2\n')
+    (home / 'b.csv').write_text('// comment\n\nLatitude,Value\n3,4')
+    (home / 'c.csv').write_text('// comment\nLatitude,Value\n5,6\n')
+    calls.stitchCsv([str(home / name) for name in ('a.csv', 'b.csv', 'c.csv')], str(home / 'out.csv'))
+    assert (home / 'out.csv').read_text() == '// comment\nLatitude,Value\n1,2\n3,4\n5,6\n'
+
+
+def test_repeated_jobs_are_fetched_once(calls, navigator, home):
+    query, fileName = profileJob('giops_day', 'votemper', 'day', 100, [47.5, -52.7])
+    summary = calls.batch([(query, fileName), (query, fileName)], 'CSV')
+    assert summary['succeeded'] == [fileName, fileName]
+    assert navigator.counts['plot'] == 1
+
+    # and an identical batch later comes from the result cache
+    summary = calls.batch([(query, fileName)], 'CSV')
+    assert (summary['cacheHits'], navigator.counts['plot']) == (1, 1)
+
+def test_profile_rows_get_query_time(calls, home):
+    np = pytest.importorskip('numpy')
+    time = latestTime()
+    jobs = [profileJob('giops_day', 'votemper', 'day', time, [47.5, -52.7]),
+            profileJob('giops_day', 'votemper', 'day', time, [46.0, -50.0])]
+    calls.columnarBatch(jobs, str(home / 'store'))
+
+    data = np.load(str(home / 'store.npy'))
+    assert len(data) == 4
+    # timestamp ids count seconds from 1950
+    assert (data['time'] == np.datetime64('1950-01-01T00:00:00') + np.timedelta64(time, 's')).all()
+    with open(home / 'store.json') as f:
+        assert json.load(f)['stations'] == [fileName for _, fileName in jobs]
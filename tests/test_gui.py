@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+pytest.importorskip('PySide2')
+
+from PySide2.QtCore import Qt  # noqa: E402
+
+from onavGUI import CoordinateModel  # noqa: E402
+
+
+def cell(model, row, col, role=Qt.DisplayRole):
+    return model.data(model.index(row, col), role)
+
+
+def test_loadText_separators_and_header():
+    model = CoordinateModel()
+    text = 'lat,lon\n47.5,-52.7\n\n46;-50\n45.25\t-49.5\n44 -48\n'
+    assert model.loadText(text) == 4
+    points, bad = model.points()
+    assert points == [[47.5, -52.7], [46.0, -50.0], [45.25, -49.5], [44.0, -48.0]]
+    assert bad.tolist() == []
+
+def test_bad_and_incomplete_rows():
+    model = CoordinateModel()
+    model.loadText('47.5,-52.7\nnorth,-50\n95,-50\n46\n')
+    points, bad = model.points()
+    # out of range and unparseable rows are reported, a half-filled row is skipped
+    assert points == [[47.5, -52.7], [95.0, -50.0]]
+    assert bad.tolist() == [1, 2]
+    assert cell(model, 1, 0) == 'north'
+    assert cell(model, 3, 1) == ''
+
+def test_loadText_at_row_keeps_earlier_rows():
+    model = CoordinateModel()
+    model.loadText('1,2\n3,4\n')
+    model.loadText('5,6\n', startRow=1)
+    assert model.points()[0] == [[1.0, 2.0], [5.0, 6.0]]
+
+def test_edit_keeps_full_precision():
+    model = CoordinateModel()
+    model.setData(model.index(0, 0), '47.123456789')
+    model.setData(model.index(0, 1), '-123.456789')
+    assert cell(model, 0, 0) == '47.123457'
+    assert cell(model, 0, 1) == '-123.456789'
+
+    # saving the editor's text back doesn't round the coordinate
+    model.setData(model.index(0, 0), cell(model, 0, 0, Qt.EditRole))
+    assert model.points()[0] == [[47.123456789, -123.456789]]
+
+def test_setData_invalid_then_cleared():
+    model = CoordinateModel()
+    model.setData(model.index(0, 0), 'x')
+    assert model.badRows().tolist() == [0]
+    model.setData(model.index(0, 0), '')
+    assert model.badRows().tolist() == []
+    assert model.points()[0] == []
+
+def test_setRowCount():
+    model = CoordinateModel()
+    model.loadText('1,2\n3,4\n5,x\n')
+    model.setRowCount(2)
+    assert model.rowCount() == 2
+    assert model.badText == {}
+    model.setRowCount(4)
+    assert model.points()[0] == [[1.0, 2.0], [3.0, 4.0]]
+
+def test_loadGeoJSON_is_lon_lat():
+    model = CoordinateModel()
+    geometry = {'type' : 'Polygon', 'coordinates' : [[[-60, 50], [-50, 50], [-50, 45]]]}
+    feature = {'type' : 'FeatureCollection', 'features' : [{'type' : 'Feature', 'geometry' : geometry}]}
+    assert model.loadGeoJSON(json.dumps(feature)) == 3
+    assert model.points()[0] == [[50.0, -60.0], [50.0, -50.0], [45.0, -50.0]]